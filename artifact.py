@@ -1,10 +1,63 @@
 from abc import ABC, abstractmethod
 import json
+import asyncio
+import hashlib
 import inspect
 from artifact_logger import setup_logger
+from artifact_ratelimit import RetryPolicy, call_with_retry, acall_with_retry, get_limiter
+from artifact_singleflight import SingleFlight
+from artifact_metrics import instrument_class
 import os
 
+def summarize_data(value):
+    # Keeps reprs and logs from formatting entire images or audio clips
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, dict):
+        return {key: summarize_data(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [summarize_data(item) for item in value]
+    return value
+
+def _is_json_serializable(data):
+    try:
+        json.dumps(data)
+        return True
+    except (TypeError, OverflowError, ValueError):
+        return False
+
 class Artifact(ABC):
+    __slots__ = ('prompt', 'payload_data', 'mandatory_tags', 'optional_tags', 'data', 'metadata', 'constructed')
+
+    # Shared by every instance, each subclass gets its own named logger in __init_subclass__
+    logger = setup_logger("Artifact")
+    # Set to False to skip checking that prompt, tags and metadata are JSON serializable, e.g. when
+    # planning many artifacts from values already known to be plain JSON
+    validate_json = True
+    # Optional artifact_cache.ArtifactCache shared by every instance of the class, set on a subclass to scope it
+    cache = None
+    # Name of the upstream service generate_data talks to, used to apply per-provider limits
+    provider = None
+    # How failed provider calls are retried, the rate limit itself is shared per provider (see artifact_ratelimit.configure)
+    retry_policy = RetryPolicy()
+    # Concurrent constructions with the same cache_key share one generate_data call, None disables this
+    single_flight = SingleFlight()
+    # Every concrete subclass by class name, so stored artifacts can be rebuilt from their manifest
+    registry = {}
+    # Optional artifact_store.ArtifactStore that large binary data is moved into once constructed,
+    # leaving lazy Blob handles in data instead of the bytes themselves
+    blob_store = None
+    blob_threshold = 64 * 1024
+    # Optional artifact_metrics.MetricsSink that construct, generate_data, validate_data and
+    # output_data_to_file report their timings, bytes and retries to
+    metrics = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Artifact.registry[cls.__name__] = cls
+        cls.logger = setup_logger(cls.__name__)
+        instrument_class(cls)
+
     def __init__(self, prompt: dict, payload_data=None, mandatory_tags: dict = None, optional_tags: dict = None, data: dict = None, metadata: dict = None, constructed: bool = False, **kwargs):
         self.prompt = prompt
         self.payload_data = payload_data
@@ -12,9 +65,8 @@ class Artifact(ABC):
         self.optional_tags = optional_tags or {}
         self.data = data
         self.metadata = metadata
-        self.constructed = constructed
-        
-        self.logger = setup_logger(self.__class__.__name__)
+        # Loaded data still goes through construct() below to be validated
+        self.constructed = False
         
         if (data is None) != (metadata is None):
             raise ValueError("Can't load data without metadata or vice versa.")
@@ -28,21 +80,14 @@ class Artifact(ABC):
             if key not in excluded_keys:
                 self.optional_tags[key] = value
         
-        # Should this check be done elsewhere?
-        def is_json_serializable(data):
-            try:
-                json.dumps(data)
-                return True
-            except (TypeError, OverflowError, ValueError):
-                return False
-    
-        if not is_json_serializable(self.prompt):
-            raise ValueError("Prompt must be JSON serializable.")
-        if not is_json_serializable(self.mandatory_tags):
-            raise ValueError("Mandatory tags must be JSON serializable.")
-        if not is_json_serializable(self.optional_tags):
-            raise ValueError("Optional tags must be JSON serializable.")
-        if metadata is not None and not is_json_serializable(self.metadata):
+        # One dumps over everything, the fields are only checked one by one to name the culprit
+        if self.validate_json and not _is_json_serializable((self.prompt, self.mandatory_tags, self.optional_tags, self.metadata)):
+            if not _is_json_serializable(self.prompt):
+                raise ValueError("Prompt must be JSON serializable.")
+            if not _is_json_serializable(self.mandatory_tags):
+                raise ValueError("Mandatory tags must be JSON serializable.")
+            if not _is_json_serializable(self.optional_tags):
+                raise ValueError("Optional tags must be JSON serializable.")
             raise ValueError("Metadata must be JSON serializable.")
         
         if constructed:
@@ -62,18 +107,106 @@ class Artifact(ABC):
         if data is None:
             raise RuntimeError("Generation failed to set the artifact data")
 
-    def construct(self):
+    def cache_key(self) -> str:
+        canonical = json.dumps({
+            'class': self.__class__.__name__,
+            'prompt': self.prompt,
+            'mandatory_tags': self.mandatory_tags,
+            'optional_tags': self.optional_tags
+        }, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _load_cached(self):
+        """
+        Fill data and metadata from the cache when possible.
+
+        :return: The key to store freshly generated data under, or None if there is nothing to store.
+        """
         if self.constructed:
             raise RuntimeError("Artifact is already constructed")
-        
-        if self.data is None:
-            self.data, self.metadata = self.generate_data(self.prompt, self.payload_data)
-            
+
+        if self.data is not None or self.cache is None:
+            return None
+
+        cache_key = self.cache_key()
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return cache_key
+
+        self.logger.debug("Cache hit for %s", cache_key)
+        data, metadata = cached
+        self.data, self.metadata = dict(data), (dict(metadata) if metadata is not None else None)
+        return None
+
+    def _shared_result(self, result):
+        # What the cache and coalesced waiters get in place of this artifact's own (data, metadata),
+        # subclasses swap out data that must not be shared, e.g. handles on files the caller owns
+        return result
+
+    def _complete_construct(self, cache_key):
         self.validate_data(self.data)
+        if self.blob_store is not None:
+            self.offload()
+        if cache_key is not None:
+            data, metadata = self._shared_result((self.data, self.metadata))
+            # The cache keeps its own dicts so that later edits to this artifact don't leak into cache hits
+            self.cache.set(cache_key, (dict(data), dict(metadata) if metadata is not None else None))
         self.constructed = True
+
+    def _take_result(self, result, shared: bool):
+        data, metadata = result
+        if shared:
+            # Every waiter gets its own dicts so that later edits don't leak between artifacts
+            data, metadata = dict(data), (dict(metadata) if metadata is not None else None)
+        self.data, self.metadata = data, metadata
+
+    def construct(self):
+        cache_key = self._load_cached()
+        if self.data is None:
+            if self.single_flight is None:
+                self.data, self.metadata = self.generate_data(self.prompt, self.payload_data)
+            else:
+                result, shared = self.single_flight.do(cache_key or self.cache_key(), lambda: self.generate_data(self.prompt, self.payload_data), self._shared_result)
+                self._take_result(result, shared)
+        self._complete_construct(cache_key)
+
+    async def agenerate_data(self, prompt: dict, payload_data):
+        # Artifacts without a native async path run the blocking one on a worker thread
+        return await asyncio.to_thread(self.generate_data, prompt, payload_data)
+
+    async def aconstruct(self):
+        cache_key = self._load_cached()
+        if self.data is None:
+            if self.single_flight is None:
+                self.data, self.metadata = await self.agenerate_data(self.prompt, self.payload_data)
+            else:
+                result, shared = await self.single_flight.ado(cache_key or self.cache_key(), lambda: self.agenerate_data(self.prompt, self.payload_data), self._shared_result)
+                self._take_result(result, shared)
+        self._complete_construct(cache_key)
         
+    def _call_provider(self, fn, tokens: tuple = (0, 0), usage=None):
+        return call_with_retry(fn, self.provider or "default", self.retry_policy, tokens, usage)
+
+    async def _acall_provider(self, fn, tokens: tuple = (0, 0), usage=None):
+        return await acall_with_retry(fn, self.provider or "default", self.retry_policy, tokens, usage)
+
+    def _settle_tokens(self, reserved: tuple, used: tuple):
+        # For calls whose usage is only known after _call_provider returns, e.g. a streamed response
+        get_limiter(self.provider or "default").settle(reserved, used)
+
+    def offload(self, store=None):
+        """
+        Move binary data of at least blob_threshold bytes out of memory and into blobs.
+
+        :param store: The ArtifactStore to write blobs to, defaults to the class's blob_store.
+        """
+        store = store or self.blob_store
+        if store is None:
+            raise ValueError("No blob store to offload data into.")
+        self.data = store.offload(self.data, self.blob_threshold)
+
     def __repr__(self):
-        return f"Artifact(prompt={self.prompt}, payload_data={self.payload_data}, mandatory_tags={self.mandatory_tags}, optional_tags={self.optional_tags}, data={self.data}, metadata={self.metadata}, constructed={self.constructed})"
+        return f"Artifact(prompt={self.prompt}, payload_data={self.payload_data}, mandatory_tags={self.mandatory_tags}, optional_tags={self.optional_tags}, data={summarize_data(self.data)}, metadata={self.metadata}, constructed={self.constructed})"
     
     def output_data_to_file(self, filepath: str):
         """
@@ -92,13 +225,22 @@ class Artifact(ABC):
                 'metadata': self.metadata
             }, f, indent=2)
 
-        self.logger.info(f"Data output to file: {filepath}")
+        self.logger.info("Data output to file: %s", filepath)
         
+instrument_class(Artifact)
+
 class MediaMixin:
-    def __init__(self, *args, start_time: int, end_time: int, **kwargs):
+    __slots__ = ()
+
+    def __init__(self, *args, start_time: int = None, end_time: int = None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mandatory_tags['start_time'] = start_time
-        self.mandatory_tags['end_time'] = end_time
+        # Times may instead arrive through mandatory_tags, e.g. when reloading a stored artifact
+        if start_time is not None:
+            self.mandatory_tags['start_time'] = start_time
+        if end_time is not None:
+            self.mandatory_tags['end_time'] = end_time
+        if 'start_time' not in self.mandatory_tags or 'end_time' not in self.mandatory_tags:
+            raise ValueError("MediaMixin requires a start_time and end_time.")
 
     @classmethod
     def build(cls, start_time: int, end_time: int, **kwargs):
@@ -117,6 +259,8 @@ class MediaMixin:
         return self.mandatory_tags['end_time']
     
 class GraphicalMixin:
+    __slots__ = ()
+
     def __init__(self, *args, position_x: int, position_y: int, resolution_x: int, resolution_y: int, **kwargs):
         super().__init__(*args, **kwargs)
         
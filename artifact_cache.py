@@ -0,0 +1,228 @@
+import os
+import time
+import pickle
+import threading
+from collections import OrderedDict
+from artifact_logger import setup_logger
+
+
+def estimate_size(value) -> int:
+    """
+    Cheap approximation of the in-memory footprint of cached data, used for size-based eviction.
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    return 8
+
+
+class ArtifactCache:
+    """
+    Base class for caches of (data, metadata) pairs keyed on Artifact.cache_key().
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self.logger = setup_logger(self.__class__.__name__)
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, entry: tuple):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+class MemoryCache(ArtifactCache):
+    def __init__(self, max_entries: int = 1024, max_bytes: int = None, max_age: float = None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and self.max_age is not None and time.time() - item[2] > self.max_age:
+                self._remove(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key: str, entry: tuple):
+        size = estimate_size(entry)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (entry, size, time.time())
+            self.size += size
+            while self._entries and (len(self._entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes)):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+                self.logger.debug(f"Evicted {oldest} from memory cache")
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache(ArtifactCache):
+    """
+    Pickles entries under a directory, one file per key.
+    Age is taken from the file's mtime and recency from its atime, which is bumped on every hit.
+    """
+    def __init__(self, directory: str, max_bytes: int = None, max_age: float = None):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._index = None
+        # Running total of the indexed file sizes, so writes don't have to re-sum the index
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith('.pkl'):
+                        stat = os.stat(os.path.join(root, name))
+                        self._index[name[:-4]] = (stat.st_size, stat.st_atime)
+            self._size = sum(size for size, _ in self._index.values())
+        return self._index
+
+    def _track(self, key: str, size: int, atime: float):
+        index = self._load_index()
+        previous = index.get(key)
+        index[key] = (size, atime)
+        self._size += size - (previous[0] if previous is not None else 0)
+
+    def _untrack(self, key: str):
+        previous = self._load_index().pop(key, None)
+        if previous is not None:
+            self._size -= previous[0]
+
+    def get(self, key: str):
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._untrack(key)
+                self.misses += 1
+                return None
+            now = time.time()
+            if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                self._remove(key)
+                self.misses += 1
+                return None
+            try:
+                with open(path, 'rb') as f:
+                    entry = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                self.logger.warning(f"Discarding unreadable cache entry {key}: {str(e)}")
+                self._remove(key)
+                self.misses += 1
+                return None
+            os.utime(path, (now, stat.st_mtime))
+            self._track(key, stat.st_size, now)
+            self.hits += 1
+            return entry
+
+    def set(self, key: str, entry: tuple):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._track(key, os.path.getsize(path), time.time())
+            # Only a write that goes over the limit pays for ordering the index
+            if self.max_bytes is not None and self._size > self.max_bytes:
+                index = self._load_index()
+                for oldest in sorted(index, key=lambda k: index[k][1]):
+                    if self._size <= self.max_bytes:
+                        break
+                    self._remove(oldest)
+                    self.evictions += 1
+                    self.logger.debug("Evicted %s from disk cache", oldest)
+
+    def _remove(self, key: str):
+        self._untrack(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            self._load_index()
+            return self._size
+
+    def __len__(self):
+        return len(self._load_index())
+
+
+class TieredCache(ArtifactCache):
+    """
+    In-memory LRU in front of an on-disk tier. Disk hits are promoted into memory.
+    """
+    def __init__(self, memory: MemoryCache = None, disk: DiskCache = None):
+        super().__init__()
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk
+
+    def get(self, key: str):
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def set(self, key: str, entry: tuple):
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['memory'] = self.memory.stats()
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+from artifact_logger import setup_logger
+from artifact_executor import ConstructResult, begin_construct
+from artifact_http import get_config, get_session
+from artifact_ratelimit import RetryPolicy, call_with_retry
+
+logger = setup_logger("ClaudeBatch")
+
+# The Message Batches API accepts at most 100,000 requests per batch
+MAX_BATCH_SIZE = 100000
+
+
+class BatchBackend:
+    """
+    Where a batch of message requests is sent. Requests are dicts of {"custom_id": ..., "params": ...}
+    in the Message Batches API format, results are (custom_id, result) pairs in its results format.
+    """
+    def submit(self, requests: list) -> str:
+        raise NotImplementedError
+
+    def is_done(self, batch_id: str) -> bool:
+        raise NotImplementedError
+
+    def results(self, batch_id: str):
+        raise NotImplementedError
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """
+    Talks to the Message Batches API directly over the pooled anthropic session, the pinned SDK predates it.
+    """
+    def __init__(self, provider: str = "anthropic", retry_policy: RetryPolicy = None):
+        self.provider = provider
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    def _url(self, path: str) -> str:
+        base_url = get_config(self.provider).base_url or os.getenv("ANTHROPIC_BASE_URL") or "https://api.anthropic.com"
+        return base_url.rstrip('/') + path
+
+    def _request(self, method: str, url: str, **kwargs):
+        headers = {
+            "x-api-key": os.getenv("ANTHROPIC_API_KEY", ""),
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json"
+        }
+
+        def send():
+            response = get_session(self.provider).request(method, url, headers=headers, **kwargs)
+            self.retry_policy.check_response(response.status_code, response.headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"Message Batches API request failed with status code {response.status_code}: {response.text}")
+            return response
+
+        return call_with_retry(send, self.provider, self.retry_policy)
+
+    def submit(self, requests: list) -> str:
+        response = self._request("POST", self._url("/v1/messages/batches"), data=json.dumps({"requests": requests}))
+        return response.json()["id"]
+
+    def is_done(self, batch_id: str) -> bool:
+        response = self._request("GET", self._url(f"/v1/messages/batches/{batch_id}"))
+        return response.json()["processing_status"] == "ended"
+
+    def results(self, batch_id: str):
+        batch = self._request("GET", self._url(f"/v1/messages/batches/{batch_id}")).json()
+        # Results can run to gigabytes for a full batch, so they are read line by line off the wire
+        with self._request("GET", batch["results_url"], stream=True) as response:
+            for line in response.iter_lines():
+                if line:
+                    entry = json.loads(line)
+                    yield entry["custom_id"], entry["result"]
+
+
+class StubBatchBackend(BatchBackend):
+    """
+    Local stand-in for tests. Each request is answered by responder(params), which returns the
+    response text or raises to mark that request as errored. Batches end after polls_until_done polls.
+    """
+    def __init__(self, responder=None, polls_until_done: int = 1):
+        self.responder = responder or (lambda params: params["messages"][0]["content"])
+        self.polls_until_done = polls_until_done
+        self.batches = {}
+
+    def submit(self, requests: list) -> str:
+        batch_id = f"msgbatch_stub_{len(self.batches)}"
+        self.batches[batch_id] = {"requests": requests, "polls": 0}
+        return batch_id
+
+    def is_done(self, batch_id: str) -> bool:
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        return batch["polls"] >= self.polls_until_done
+
+    def results(self, batch_id: str):
+        for request in self.batches[batch_id]["requests"]:
+            try:
+                text = self.responder(request["params"])
+            except Exception as e:
+                yield request["custom_id"], {"type": "errored", "error": {"type": "stub_error", "message": str(e)}}
+                continue
+            yield request["custom_id"], {
+                "type": "succeeded",
+                "message": {"content": [{"type": "text", "text": text}], "model": request["params"]["model"]}
+            }
+
+
+def _result_text(result: dict) -> str:
+    if result["type"] != "succeeded":
+        raise RuntimeError(f"Batch request {result['type']}: {result.get('error')}")
+    return "".join(block["text"] for block in result["message"]["content"] if block["type"] == "text")
+
+
+def construct_claude_batch(artifacts, backend: BatchBackend = None, poll_interval: float = 10.0, timeout: float = 24 * 60 * 60, max_batch_size: int = MAX_BATCH_SIZE) -> list:
+    """
+    Construct ClaudeArtifacts through the Message Batches API instead of one messages.create per artifact.
+    Cached artifacts are filled from the cache, artifacts with the same cache_key share one request,
+    and results are fanned back into each artifact's data and metadata.
+
+    :return: One ConstructResult per artifact, in input order.
+    """
+    backend = backend or AnthropicBatchBackend()
+    artifacts = list(artifacts)
+    results = [None] * len(artifacts)
+    start = time.perf_counter()
+
+    # custom_id is the cache_key, which fits the API's 64 character id limit exactly
+    pending = {}
+    constructions = {}
+    for index, artifact in enumerate(artifacts):
+        construction = begin_construct(artifact)
+        if isinstance(construction, ConstructResult):
+            results[index] = construction
+            continue
+        constructions[index] = construction
+        pending.setdefault(construction.cache_key or artifact.cache_key(), []).append(index)
+
+    requests = []
+    for custom_id, indices in pending.items():
+        leader = artifacts[indices[0]]
+        requests.append({"custom_id": custom_id, "params": leader._message_params(leader.prompt)})
+        constructions[indices[0]].generate.add(bytes_out=len(json.dumps(requests[-1])))
+    def fail_chunk(chunk, error):
+        for custom_id in [request["custom_id"] for request in chunk if request["custom_id"] in pending]:
+            for index in pending.pop(custom_id):
+                results[index] = constructions[index].fail(error)
+
+    def collect(batch_id, chunk):
+        try:
+            for custom_id, result in backend.results(batch_id):
+                for index in pending.pop(custom_id, []):
+                    artifact, construction = artifacts[index], constructions[index]
+                    try:
+                        text = _result_text(result)
+                        construction.generate.add(bytes_in=len(text.encode('utf-8')))
+                        data, metadata = artifact._response_result(artifact.prompt, text)
+                        metadata["batch_id"] = batch_id
+                    except Exception as e:
+                        results[index] = construction.fail(e)
+                        continue
+                    results[index] = construction.finish(data, metadata)
+        except Exception as e:
+            # Results already read stay constructed, only the rest of the chunk is lost
+            logger.error("Reading results of batch %s failed: %s", batch_id, e)
+            fail_chunk(chunk, e)
+            return
+        fail_chunk(chunk, RuntimeError(f"Batch {batch_id} returned no result"))
+
+    # Every chunk is submitted before any is polled so the API works through them side by side.
+    # A chunk that fails or outlives the timeout only fails its own artifacts, the other chunks still count
+    batches = {}
+    for offset in range(0, len(requests), max_batch_size):
+        chunk = requests[offset:offset + max_batch_size]
+        try:
+            batch_id = backend.submit(chunk)
+        except Exception as e:
+            logger.error("Submitting a batch of %d requests failed: %s", len(chunk), e)
+            fail_chunk(chunk, e)
+            continue
+        logger.info("Submitted batch %s with %d requests", batch_id, len(chunk))
+        batches[batch_id] = chunk
+
+    deadline = time.monotonic() + timeout
+    while batches:
+        for batch_id, chunk in list(batches.items()):
+            try:
+                done = backend.is_done(batch_id)
+            except Exception as e:
+                logger.error("Polling batch %s failed: %s", batch_id, e)
+                del batches[batch_id]
+                fail_chunk(chunk, e)
+                continue
+            if done:
+                del batches[batch_id]
+                collect(batch_id, chunk)
+        if not batches:
+            break
+        if time.monotonic() > deadline:
+            for batch_id, chunk in batches.items():
+                logger.error("Batch %s did not finish within %s seconds", batch_id, timeout)
+                fail_chunk(chunk, TimeoutError(f"Batch {batch_id} did not finish within {timeout} seconds"))
+            break
+        time.sleep(poll_interval)
+
+    failures = sum(1 for result in results if not result.ok)
+    logger.info("Constructed %d/%d Claude artifacts in %.2fs", len(results) - failures, len(results), time.perf_counter() - start)
+    return results
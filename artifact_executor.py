@@ -0,0 +1,210 @@
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from artifact_logger import setup_logger
+import artifact_metrics
+
+logger = setup_logger("ArtifactExecutor")
+
+# Upper bound on simultaneous generate_data calls per provider when construct_many is not given one
+DEFAULT_PROVIDER_LIMITS = {
+    "stability": 4,
+    "elevenlabs": 4,
+    "anthropic": 8
+}
+
+
+class ConstructResult:
+    def __init__(self, artifact, error: Exception = None, elapsed: float = 0.0):
+        self.artifact = artifact
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return f"ConstructResult(artifact={self.artifact.__class__.__name__}, ok={self.ok}, error={self.error!r}, elapsed={self.elapsed:.3f})"
+
+
+def provider_of(artifact) -> str:
+    return artifact.provider or "default"
+
+
+def construct_one(artifact) -> ConstructResult:
+    """
+    Construct a single artifact, capturing rather than raising any failure.
+    """
+    start = time.perf_counter()
+    try:
+        if not artifact.constructed:
+            artifact.construct()
+    except Exception as e:
+        logger.error(f"Construction of {artifact.__class__.__name__} failed: {str(e)}")
+        return ConstructResult(artifact, e, time.perf_counter() - start)
+    return ConstructResult(artifact, elapsed=time.perf_counter() - start)
+
+
+class PendingConstruct:
+    """
+    A construction whose data is generated outside the artifact, e.g. by a batch API or a parse pool.
+    Its construct and generate measurements stay open until finish() or fail() is called.
+    """
+    def __init__(self, artifact, cache_key: str, measurement):
+        self.artifact = artifact
+        self.cache_key = cache_key
+        self.start = time.perf_counter()
+        self.construct = measurement
+        self.generate = artifact_metrics.begin(artifact, "generate", measurement)
+
+    def active(self):
+        """
+        Make the generate measurement current, e.g. around the network call that fetches the data.
+        """
+        return artifact_metrics.active(self.generate)
+
+    def finish(self, data: dict, metadata: dict) -> ConstructResult:
+        """
+        Validate and cache generated data as construct() would, capturing rather than raising any failure.
+        """
+        artifact = self.artifact
+        try:
+            artifact.data, artifact.metadata = data, metadata
+            artifact_metrics.end(self.generate)
+            with artifact_metrics.active(self.construct):
+                artifact._complete_construct(self.cache_key)
+        except Exception as e:
+            return self.fail(e)
+        artifact_metrics.end(self.construct)
+        return ConstructResult(artifact, elapsed=time.perf_counter() - self.start)
+
+    def fail(self, error: Exception) -> ConstructResult:
+        logger.error(f"Construction of {self.artifact.__class__.__name__} failed: {str(error)}")
+        self.artifact.data, self.artifact.metadata = None, None
+        # Either phase may still be open, an ended one already has its wall time
+        for measurement in (self.generate, self.construct):
+            if measurement.wall_time is None:
+                artifact_metrics.end(measurement, error)
+        return ConstructResult(self.artifact, error, time.perf_counter() - self.start)
+
+
+def begin_construct(artifact):
+    """
+    Start constructing an artifact whose data will be generated elsewhere. Constructed and cached
+    artifacts are finished straight away.
+
+    :return: A ConstructResult when there is nothing left to generate, otherwise a PendingConstruct.
+    """
+    if artifact.constructed:
+        return ConstructResult(artifact)
+    start = time.perf_counter()
+    measurement = artifact_metrics.begin(artifact, "construct")
+    try:
+        with artifact_metrics.active(measurement):
+            cache_key = artifact._load_cached()
+            if artifact.data is not None:
+                artifact._complete_construct(None)
+    except Exception as e:
+        artifact_metrics.end(measurement, e)
+        return ConstructResult(artifact, e, time.perf_counter() - start)
+    if artifact.constructed:
+        artifact_metrics.end(measurement)
+        return ConstructResult(artifact, elapsed=time.perf_counter() - start)
+    return PendingConstruct(artifact, cache_key, measurement)
+
+
+def construct_many(artifacts, max_concurrency: int = 8, provider_limits: dict = None) -> list:
+    """
+    Construct artifacts concurrently on a thread pool.
+
+    :param artifacts: Iterable of artifacts, already constructed ones are passed through.
+    :param max_concurrency: Total number of generate_data calls in flight at once.
+    :param provider_limits: Mapping of provider name to its own in-flight limit, defaults to DEFAULT_PROVIDER_LIMITS.
+    :return: One ConstructResult per artifact, in input order. A failure never aborts the batch.
+    """
+    artifacts = list(artifacts)
+    limits = dict(DEFAULT_PROVIDER_LIMITS)
+    limits.update(provider_limits or {})
+    if max_concurrency < 1 or any(limit < 1 for limit in limits.values()):
+        raise ValueError("Concurrency limits must be at least 1.")
+
+    results = [None] * len(artifacts)
+    pending = {}
+    for index, artifact in enumerate(artifacts):
+        if artifact.constructed:
+            results[index] = ConstructResult(artifact)
+        else:
+            pending.setdefault(provider_of(artifact), deque()).append(index)
+
+    logger.info(f"Constructing {sum(len(q) for q in pending.values())} artifacts across {len(pending)} providers")
+    in_flight = {provider: 0 for provider in pending}
+    futures = {}
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while pending or futures:
+            # Hand out free slots round-robin so one busy provider can't starve the others
+            submitted = True
+            while submitted and len(futures) < max_concurrency:
+                submitted = False
+                for provider in list(pending):
+                    queue = pending[provider]
+                    if len(futures) >= max_concurrency or in_flight[provider] >= limits.get(provider, max_concurrency):
+                        continue
+                    index = queue.popleft()
+                    futures[pool.submit(construct_one, artifacts[index])] = (index, provider)
+                    in_flight[provider] += 1
+                    submitted = True
+                    if not queue:
+                        del pending[provider]
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, provider = futures.pop(future)
+                in_flight[provider] -= 1
+                results[index] = future.result()
+
+    failures = sum(1 for result in results if not result.ok)
+    logger.info(f"Constructed {len(results) - failures}/{len(results)} artifacts in {time.perf_counter() - start:.2f}s")
+    return results
+
+
+async def aconstruct_one(artifact) -> ConstructResult:
+    start = time.perf_counter()
+    try:
+        if not artifact.constructed:
+            await artifact.aconstruct()
+    except Exception as e:
+        logger.error(f"Construction of {artifact.__class__.__name__} failed: {str(e)}")
+        return ConstructResult(artifact, e, time.perf_counter() - start)
+    return ConstructResult(artifact, elapsed=time.perf_counter() - start)
+
+
+async def aconstruct_many(artifacts, max_concurrency: int = 64, provider_limits: dict = None) -> list:
+    """
+    Async counterpart of construct_many, running every artifact's aconstruct on the current event loop.
+    The same per-provider limits apply, enforced with semaphores instead of pool slots.
+    """
+    artifacts = list(artifacts)
+    limits = dict(DEFAULT_PROVIDER_LIMITS)
+    limits.update(provider_limits or {})
+    if max_concurrency < 1 or any(limit < 1 for limit in limits.values()):
+        raise ValueError("Concurrency limits must be at least 1.")
+
+    overall = asyncio.Semaphore(max_concurrency)
+    semaphores = {}
+
+    async def run(artifact):
+        provider = provider_of(artifact)
+        if provider not in semaphores:
+            semaphores[provider] = asyncio.Semaphore(limits.get(provider, max_concurrency))
+        async with semaphores[provider], overall:
+            return await aconstruct_one(artifact)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run(artifact) for artifact in artifacts))
+    failures = sum(1 for result in results if not result.ok)
+    logger.info(f"Constructed {len(results) - failures}/{len(results)} artifacts in {time.perf_counter() - start:.2f}s")
+    return list(results)
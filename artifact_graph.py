@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+from urllib.parse import quote
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from artifact_logger import setup_logger
+
+
+class GraphNode:
+    """
+    A node is either a root holding an Artifact instance, or a derived node whose artifact is
+    built by factory(*input_artifacts) once every input has been constructed.
+    """
+    def __init__(self, name: str, artifact=None, factory=None, inputs: tuple = ()):
+        self.name = name
+        self.artifact = artifact
+        self.factory = factory
+        self.inputs = tuple(inputs)
+
+    def __repr__(self):
+        return f"GraphNode(name={self.name}, inputs={self.inputs})"
+
+
+class GraphState:
+    """
+    Persisted outputs of a previous run, one pickle per node holding its fingerprint, data and metadata.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, quote(name, safe='') + '.pkl')
+
+    def load(self, name: str, fingerprint: str):
+        try:
+            with open(self._path(name), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if entry.get('fingerprint') != fingerprint:
+            return None
+        return entry['data'], entry['metadata']
+
+    def save(self, name: str, fingerprint: str, artifact):
+        path = self._path(name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({
+                'fingerprint': fingerprint,
+                'data': artifact.data,
+                'metadata': artifact.metadata
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+
+def fingerprint(artifact, upstream_fingerprints: list) -> str:
+    """
+    A node's fingerprint covers its own class, prompt and tags plus the fingerprints of its inputs,
+    so any upstream change invalidates every descendant.
+    """
+    canonical = json.dumps([artifact.cache_key(), upstream_fingerprints], separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class GraphRun:
+    def __init__(self):
+        self.artifacts = {}
+        self.fingerprints = {}
+        self.reused = []
+        self.errors = {}
+        self.skipped = []
+        self.timings = {}
+        self.critical_path = []
+        self.critical_path_time = 0.0
+        self.wall_time = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors and not self.skipped
+
+    def __repr__(self):
+        return f"GraphRun(constructed={len(self.artifacts)}, reused={len(self.reused)}, errors={list(self.errors)}, skipped={self.skipped}, critical_path={self.critical_path}, critical_path_time={self.critical_path_time:.3f}, wall_time={self.wall_time:.3f})"
+
+
+class ArtifactGraph:
+    def __init__(self):
+        self.nodes = {}
+        self.logger = setup_logger(self.__class__.__name__)
+
+    def add(self, name: str, artifact) -> str:
+        """
+        Add a root artifact to the graph.
+
+        :return: The node name, for use as an input to derive().
+        """
+        self._add_node(GraphNode(name, artifact=artifact))
+        return name
+
+    def derive(self, name: str, factory, *inputs: str) -> str:
+        """
+        Add a node built from upstream artifacts.
+
+        :param factory: Called as factory(*upstream_artifacts) with constructed artifacts, must return an Artifact.
+        :param inputs: Names of the upstream nodes, passed to the factory in this order.
+        :return: The node name.
+        """
+        if not inputs:
+            raise ValueError("A derived node needs at least one input, use add() for root artifacts.")
+        self._add_node(GraphNode(name, factory=factory, inputs=inputs))
+        return name
+
+    def _add_node(self, node: GraphNode):
+        if node.name in self.nodes:
+            raise ValueError(f"Graph already has a node named {node.name}")
+        self.nodes[node.name] = node
+
+    def dependents(self) -> dict:
+        dependents = {name: [] for name in self.nodes}
+        for node in self.nodes.values():
+            for upstream in dict.fromkeys(node.inputs):
+                if upstream not in self.nodes:
+                    raise ValueError(f"Node {node.name} depends on unknown node {upstream}")
+                dependents[upstream].append(node.name)
+        return dependents
+
+    def topological_order(self) -> list:
+        dependents = self.dependents()
+        remaining = {name: len(set(node.inputs)) for name, node in self.nodes.items()}
+        ready = deque(name for name, count in remaining.items() if count == 0)
+        order = []
+        while ready:
+            name = ready.popleft()
+            order.append(name)
+            for downstream in dependents[name]:
+                remaining[downstream] -= 1
+                if remaining[downstream] == 0:
+                    ready.append(downstream)
+        if len(order) != len(self.nodes):
+            cycle = [name for name, count in remaining.items() if count > 0]
+            raise ValueError(f"Graph contains a cycle through: {cycle}")
+        return order
+
+    def _run_node(self, node: GraphNode, upstream: list, upstream_fingerprints: list, state: GraphState):
+        start = time.perf_counter()
+        reused = False
+        try:
+            # Factories only build the artifact, so calling one is cheap even when its output is reused
+            artifact = node.artifact if node.factory is None else node.factory(*upstream)
+            node_fingerprint = fingerprint(artifact, upstream_fingerprints)
+            if not artifact.constructed:
+                stored = state.load(node.name, node_fingerprint) if state is not None else None
+                if stored is not None:
+                    artifact.data, artifact.metadata = stored
+                    reused = True
+                artifact.construct()
+                if state is not None and not reused:
+                    state.save(node.name, node_fingerprint, artifact)
+        except Exception as e:
+            return None, None, False, e, start, time.perf_counter()
+        return artifact, node_fingerprint, reused, None, start, time.perf_counter()
+
+    def run(self, max_concurrency: int = 8, state_dir: str = None) -> GraphRun:
+        """
+        Construct every node, running independent branches concurrently.
+        A node starts as soon as all of its inputs are constructed. When a node fails,
+        its descendants are skipped while unrelated branches carry on.
+
+        :param state_dir: Directory persisting node outputs between runs. Nodes whose fingerprint
+            is unchanged since the last run are loaded from it instead of regenerated.
+        """
+        state = GraphState(state_dir) if state_dir is not None else None
+        order = self.topological_order()
+        dependents = self.dependents()
+        remaining = {name: len(set(node.inputs)) for name, node in self.nodes.items()}
+        ready = deque(name for name in order if remaining[name] == 0)
+        run = GraphRun()
+        futures = {}
+        origin = time.perf_counter()
+
+        self.logger.info(f"Running graph of {len(order)} nodes")
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            while ready or futures:
+                while ready and len(futures) < max_concurrency:
+                    node = self.nodes[ready.popleft()]
+                    upstream = [run.artifacts[name] for name in node.inputs]
+                    upstream_fingerprints = [run.fingerprints[name] for name in node.inputs]
+                    futures[pool.submit(self._run_node, node, upstream, upstream_fingerprints, state)] = node.name
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    artifact, node_fingerprint, reused, error, start, end = future.result()
+                    run.timings[name] = (start - origin, end - origin)
+                    if error is not None:
+                        self.logger.error(f"Node {name} failed: {str(error)}")
+                        run.errors[name] = error
+                        continue
+                    run.artifacts[name] = artifact
+                    run.fingerprints[name] = node_fingerprint
+                    if reused:
+                        run.reused.append(name)
+                    for downstream in dependents[name]:
+                        remaining[downstream] -= 1
+                        if remaining[downstream] == 0:
+                            ready.append(downstream)
+
+        run.wall_time = time.perf_counter() - origin
+        run.skipped = [name for name in order if name not in run.artifacts and name not in run.errors]
+        run.critical_path, run.critical_path_time = self._critical_path(order, run.timings)
+        self.logger.info(f"Graph finished in {run.wall_time:.2f}s reusing {len(run.reused)} nodes, critical path {' -> '.join(run.critical_path)} took {run.critical_path_time:.2f}s")
+        return run
+
+    def _critical_path(self, order: list, timings: dict):
+        # Longest chain of node durations through the graph, the lower bound on wall time at unlimited concurrency
+        finish = {}
+        previous = {}
+        for name in order:
+            if name not in timings:
+                continue
+            start, end = timings[name]
+            best = None
+            for upstream in self.nodes[name].inputs:
+                if upstream in finish and (best is None or finish[upstream] > finish[best]):
+                    best = upstream
+            finish[name] = (end - start) + (finish[best] if best is not None else 0.0)
+            previous[name] = best
+
+        if not finish:
+            return [], 0.0
+        name = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], total
@@ -0,0 +1,211 @@
+import os
+import asyncio
+import threading
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+import httpx
+import anthropic
+from artifact_logger import setup_logger
+
+logger = setup_logger("ArtifactHTTP")
+
+
+class ProviderConfig:
+    def __init__(self, pool_size: int = 10, timeout: float = 60.0, base_url: str = None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.base_url = base_url
+
+    def __repr__(self):
+        return f"ProviderConfig(pool_size={self.pool_size}, timeout={self.timeout}, base_url={self.base_url})"
+
+
+_configs = {
+    "web": ProviderConfig(pool_size=20, timeout=30.0),
+    "stability": ProviderConfig(pool_size=10, timeout=120.0, base_url="https://api.stability.ai"),
+    "elevenlabs": ProviderConfig(pool_size=10, timeout=120.0, base_url="https://api.elevenlabs.io"),
+    "anthropic": ProviderConfig(pool_size=20, timeout=600.0)
+}
+
+_lock = threading.Lock()
+_sessions = {}
+_anthropic_clients = {}
+# Async clients are tied to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+# Pending closes of dropped async clients, kept so the tasks aren't collected before they finish
+_closing = set()
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session with a keep-alive pool sized for the provider and a default timeout.
+    """
+    def __init__(self, config: ProviderConfig):
+        super().__init__()
+        self.timeout = config.timeout
+        adapter = HTTPAdapter(pool_connections=config.pool_size, pool_maxsize=config.pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_config(provider: str) -> ProviderConfig:
+    with _lock:
+        if provider not in _configs:
+            _configs[provider] = ProviderConfig()
+        return _configs[provider]
+
+
+def configure(provider: str, pool_size: int = None, timeout: float = None, base_url: str = None):
+    """
+    Change pool size, timeout or base URL for a provider. Clients already handed out for it are
+    closed so the next request picks the new settings up.
+    """
+    config = get_config(provider)
+    with _lock:
+        if pool_size is not None:
+            config.pool_size = pool_size
+        if timeout is not None:
+            config.timeout = timeout
+        if base_url is not None:
+            config.base_url = base_url
+        session = _sessions.pop(provider, None)
+        clients = [_anthropic_clients.pop(key) for key in list(_anthropic_clients) if key[0] == provider]
+        async_clients = [(loop, [loop_clients.pop(key) for key in list(loop_clients) if key[1] == provider])
+                         for loop, loop_clients in _async_clients.items()]
+    if session is not None:
+        session.close()
+    for client in clients:
+        client.close()
+    for loop, loop_clients in async_clients:
+        _close_on_loop(loop, loop_clients)
+    logger.debug(f"Configured {provider}: {config}")
+
+
+def provider_url(provider: str, path: str) -> str:
+    return get_config(provider).base_url.rstrip('/') + path
+
+
+def get_session(provider: str) -> requests.Session:
+    """
+    Process-wide keep-alive session for a provider, safe to share between threads.
+    """
+    config = get_config(provider)
+    with _lock:
+        session = _sessions.get(provider)
+        if session is None:
+            session = _sessions[provider] = PooledSession(config)
+        return session
+
+
+def get_async_client(provider: str) -> httpx.AsyncClient:
+    """
+    Pooled httpx.AsyncClient for a provider on the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    config = get_config(provider)
+    with _lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(("http", provider))
+        if client is None:
+            limits = httpx.Limits(max_connections=config.pool_size, max_keepalive_connections=config.pool_size)
+            client = loop_clients[("http", provider)] = httpx.AsyncClient(limits=limits, timeout=config.timeout, follow_redirects=True)
+        return client
+
+
+def _anthropic_kwargs(config: ProviderConfig) -> dict:
+    # Retries are left to artifact_ratelimit so they share the provider's budget and backoff
+    kwargs = {"api_key": os.getenv("ANTHROPIC_API_KEY"), "timeout": config.timeout, "max_retries": 0}
+    if config.base_url is not None:
+        kwargs["base_url"] = config.base_url
+    return kwargs
+
+
+def get_anthropic_client(provider: str = "anthropic") -> anthropic.Anthropic:
+    config = get_config(provider)
+    kwargs = _anthropic_kwargs(config)
+    key = (provider, kwargs["api_key"])
+    with _lock:
+        client = _anthropic_clients.get(key)
+        if client is None:
+            limits = httpx.Limits(max_connections=config.pool_size, max_keepalive_connections=config.pool_size)
+            http_client = httpx.Client(limits=limits, timeout=config.timeout)
+            client = _anthropic_clients[key] = anthropic.Anthropic(http_client=http_client, **kwargs)
+        return client
+
+
+def get_async_anthropic_client(provider: str = "anthropic") -> anthropic.AsyncAnthropic:
+    loop = asyncio.get_running_loop()
+    config = get_config(provider)
+    kwargs = _anthropic_kwargs(config)
+    key = ("anthropic", provider, kwargs["api_key"])
+    with _lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            limits = httpx.Limits(max_connections=config.pool_size, max_keepalive_connections=config.pool_size)
+            http_client = httpx.AsyncClient(limits=limits, timeout=config.timeout)
+            client = loop_clients[key] = anthropic.AsyncAnthropic(http_client=http_client, **kwargs)
+        return client
+
+
+async def _aclose(client):
+    # httpx closes with aclose, the Anthropic SDK clients with close
+    if isinstance(client, httpx.AsyncClient):
+        await client.aclose()
+    else:
+        await client.close()
+
+
+def _close_on_loop(loop, clients: list):
+    """
+    Schedule closing async clients on the loop that owns them. Clients of a loop that is no longer
+    running are only dropped, their connections went away with the loop.
+    """
+    if not clients or not loop.is_running():
+        return
+
+    async def close():
+        for client in clients:
+            try:
+                await _aclose(client)
+            except Exception as e:
+                logger.warning("Closing %r failed: %s", client, e)
+
+    future = asyncio.run_coroutine_threadsafe(close(), loop)
+    _closing.add(future)
+    future.add_done_callback(_closing.discard)
+
+
+def close_all():
+    """
+    Close every session and client. Async clients are closed on their own event loop if it is still
+    running, use aclose_all to wait for the current loop's clients to be closed.
+    """
+    with _lock:
+        sessions = list(_sessions.values())
+        clients = list(_anthropic_clients.values())
+        async_clients = [(loop, list(loop_clients.values())) for loop, loop_clients in _async_clients.items()]
+        _sessions.clear()
+        _anthropic_clients.clear()
+        _async_clients.clear()
+    for session in sessions:
+        session.close()
+    for client in clients:
+        client.close()
+    for loop, loop_clients in async_clients:
+        _close_on_loop(loop, loop_clients)
+
+
+async def aclose_all():
+    """
+    Close the async clients of the running event loop, e.g. at the end of the coroutine passed to asyncio.run.
+    """
+    with _lock:
+        loop_clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await _aclose(client)
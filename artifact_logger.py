@@ -1,12 +1,26 @@
 # logger_config.py
 import logging
+import logging.handlers
 import hashlib
+import functools
+import threading
+import atexit
+import queue
+import json
 import os
 if os.name == 'nt':
     import ctypes
     kernel32 = ctypes.windll.kernel32
     kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
 
+# ARTIFACT_LOG_LEVEL sets the level of every artifact logger, e.g. WARNING for large runs.
+# ARTIFACT_LOG_FORMAT=json writes one JSON object per line instead of colored text.
+# ARTIFACT_LOG_ASYNC=1 hands records to a background thread instead of writing them in the caller.
+FORMAT = '%(name)s - %(levelname)s - %(message)s'
+RESET = "\033[0m"
+BOLD = "\033[1m"
+
+@functools.lru_cache(maxsize=None)
 def get_color_from_string(s):
     hash_value = hashlib.md5(s.encode()).hexdigest()
     r = int(hash_value[:2], 16)
@@ -20,19 +34,133 @@ class ColoredFormatter(logging.Formatter):
 
     def format(self, record):
         color = get_color_from_string(record.name)
-        reset = "\033[0m"
-        bold = "\033[1m"
         message = super().format(record)
         if record.levelno >= logging.ERROR:
-            message = f"{bold}{message}{reset}"
-        return f"{color}{message}{reset}"
+            message = f"{BOLD}{message}{RESET}"
+        return f"{color}{message}{RESET}"
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'name': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def _parse_level(level):
+    """
+    A level name or number, e.g. 'warning', 'WARNING', 30 or '30'. Unknown names fall back to DEBUG
+    with a warning, so a typo in the environment can't stop the package from importing.
+    """
+    if isinstance(level, int):
+        return level
+    level = str(level).strip()
+    if level.isdigit():
+        return int(level)
+    value = logging.getLevelName(level.upper())
+    if isinstance(value, int):
+        return value
+    logging.getLogger(__name__).warning("Unknown log level %r, using DEBUG", level)
+    return logging.DEBUG
+
+def _env_flag(name):
+    return os.getenv(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+class _Settings:
+    def __init__(self):
+        self.level = _parse_level(os.getenv('ARTIFACT_LOG_LEVEL', 'DEBUG'))
+        self.json = os.getenv('ARTIFACT_LOG_FORMAT', '').lower() == 'json'
+        self.use_queue = _env_flag('ARTIFACT_LOG_ASYNC')
+        self.stream = None
+
+_settings = _Settings()
+_lock = threading.RLock()
+# Names handed out by setup_logger, so configure_logging can rewire them
+_names = set()
+_listener = None
+_queue_handler = None
+
+def _output_handler():
+    handler = logging.StreamHandler(_settings.stream)
+    handler.setFormatter(JsonFormatter() if _settings.json else ColoredFormatter(FORMAT))
+    return handler
+
+def _handler():
+    """
+    The handler every artifact logger writes to. In queue mode that is one shared QueueHandler
+    whose listener thread does the formatting and the writing.
+    """
+    global _listener, _queue_handler
+    if not _settings.use_queue:
+        return _output_handler()
+    if _queue_handler is None:
+        records = queue.SimpleQueue()
+        _queue_handler = logging.handlers.QueueHandler(records)
+        _listener = logging.handlers.QueueListener(records, _output_handler(), respect_handler_level=True)
+        _listener.start()
+    return _queue_handler
+
+def _attach(logger):
+    for handler in list(logger.handlers):
+        if handler is not _queue_handler:
+            handler.close()
+        logger.removeHandler(handler)
+    logger.setLevel(_settings.level)
+    logger.addHandler(_handler())
+
+def _stop_listener():
+    global _listener, _queue_handler
+    if _listener is not None:
+        # Flushes whatever is still queued
+        _listener.stop()
+    _listener, _queue_handler = None, None
+
+def shutdown_logging():
+    """
+    Flush and stop the queue listener. Loggers are switched to writing directly, so records logged
+    afterwards, e.g. by other atexit handlers, still reach the stream.
+    """
+    with _lock:
+        if _listener is None:
+            return
+        _stop_listener()
+        _settings.use_queue = False
+        for name in _names:
+            _attach(logging.getLogger(name))
+
+atexit.register(shutdown_logging)
+
+def configure_logging(level=None, json_format: bool = None, use_queue: bool = None, stream=None):
+    """
+    Change level, output format or queueing for every artifact logger, overriding the environment.
+
+    :param level: Level name or number.
+    :param stream: Where records are written, defaults to stderr.
+    """
+    with _lock:
+        if level is not None:
+            _settings.level = _parse_level(level)
+        if json_format is not None:
+            _settings.json = json_format
+        if use_queue is not None:
+            _settings.use_queue = use_queue
+        if stream is not None:
+            _settings.stream = stream
+        _stop_listener()
+        for name in _names:
+            _attach(logging.getLogger(name))
 
-def setup_logger(name, level=logging.DEBUG):
+def setup_logger(name, level=None):
     logger = logging.getLogger(name)
-    if not logger.handlers:
-        logger.setLevel(level)
-        formatter = ColoredFormatter('%(name)s - %(levelname)s - %(message)s')
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-    return logger
\ No newline at end of file
+    with _lock:
+        if name not in _names:
+            _names.add(name)
+            _attach(logger)
+            if level is not None:
+                logger.setLevel(level)
+    return logger
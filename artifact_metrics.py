@@ -0,0 +1,385 @@
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from artifact_logger import setup_logger
+
+logger = setup_logger("ArtifactMetrics")
+
+# Counters every measurement and sink event carries
+COUNTERS = ('network_time', 'bytes_in', 'bytes_out', 'retries')
+
+
+class Measurement:
+    """
+    Timing and resource counters for one phase of one artifact. Counters recorded while a measurement
+    is current are added to it and to every enclosing measurement, so a construct sees the network
+    time and bytes of the generate_data call inside it.
+    """
+    def __init__(self, artifact, phase: str, parent=None):
+        self.artifact = artifact
+        self.phase = phase
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.wall_time = None
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # Wall time of the nested phases, e.g. generate and validate inside construct
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        measurement = self
+        while measurement is not None:
+            with measurement._lock:
+                for key, value in counters.items():
+                    measurement.counters[key] += value
+            measurement = measurement.parent
+
+    def finish(self):
+        self.wall_time = time.perf_counter() - self.start
+        if self.parent is not None:
+            with self.parent._lock:
+                self.parent.phases[self.phase] = self.parent.phases.get(self.phase, 0.0) + self.wall_time
+
+    def summary(self) -> dict:
+        summary = {'wall_time': self.wall_time}
+        summary.update(self.counters)
+        for phase, wall_time in self.phases.items():
+            summary[f'{phase}_time'] = wall_time
+        return summary
+
+
+_current = contextvars.ContextVar("artifact_measurement", default=None)
+
+
+def current():
+    return _current.get()
+
+
+def record(**counters):
+    """
+    Add to the counters of the current measurement, if there is one.
+    """
+    measurement = _current.get()
+    if measurement is not None:
+        measurement.add(**counters)
+
+
+@contextmanager
+def network():
+    """
+    Count the time spent in the block as network time.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(network_time=time.perf_counter() - start)
+
+
+def timed_iter(chunks):
+    """
+    Pass chunks through, counting the time spent waiting for each as network time and its size as bytes in.
+    """
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            record(network_time=time.perf_counter() - start)
+            return
+        record(network_time=time.perf_counter() - start, bytes_in=len(chunk))
+        yield chunk
+
+
+async def atimed_iter(chunks):
+    chunks = chunks.__aiter__()
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            record(network_time=time.perf_counter() - start)
+            return
+        record(network_time=time.perf_counter() - start, bytes_in=len(chunk))
+        yield chunk
+
+
+def _event(measurement: Measurement, error: BaseException = None) -> dict:
+    artifact = measurement.artifact
+    event = {
+        'timestamp': time.time(),
+        'artifact': artifact.__class__.__name__,
+        'provider': artifact.provider or "default",
+        'phase': measurement.phase,
+        'wall_time': measurement.wall_time,
+        'ok': error is None,
+        'error': type(error).__name__ if error is not None else None
+    }
+    event.update(measurement.counters)
+    return event
+
+
+def _emit(measurement: Measurement, error: BaseException = None):
+    sink = measurement.artifact.metrics
+    if sink is None:
+        return
+    try:
+        sink.record(_event(measurement, error))
+    except Exception as e:
+        # Broken metrics must never fail a construction
+        logger.warning(f"Metrics sink {sink.__class__.__name__} failed: {str(e)}")
+
+
+def _after_construct(artifact, measurement: Measurement):
+    # Only a construction that generated its data has numbers worth keeping with it, and a fresh
+    # dict keeps them out of the copy already handed to the cache
+    if 'generate' in measurement.phases:
+        artifact.metadata = dict(artifact.metadata or {}, metrics=measurement.summary())
+
+
+def begin(artifact, phase: str, parent: Measurement = None) -> Measurement:
+    """
+    Start measuring a phase that doesn't fit in one with block, e.g. one whose steps run on different
+    threads. Make it current with active() around each step and close it with end().
+
+    :param parent: The enclosing measurement, defaults to the current one.
+    """
+    return Measurement(artifact, phase, parent if parent is not None else _current.get())
+
+
+@contextmanager
+def active(measurement: Measurement):
+    token = _current.set(measurement)
+    try:
+        yield measurement
+    finally:
+        _current.reset(token)
+
+
+def end(measurement: Measurement, error: BaseException = None):
+    measurement.finish()
+    _emit(measurement, error)
+    if error is None and measurement.phase == 'construct':
+        _after_construct(measurement.artifact, measurement)
+
+
+@contextmanager
+def measure(artifact, phase: str):
+    measurement = begin(artifact, phase)
+    try:
+        with active(measurement):
+            yield measurement
+    except BaseException as e:
+        end(measurement, e)
+        raise
+    end(measurement)
+
+
+def measure_iter(artifact, phase: str, iterator):
+    """
+    Measure iterating over iterator as phase. The measurement is only current while the iterator runs,
+    not while the consumer handles what it yielded, though its wall time spans both.
+    """
+    measurement = begin(artifact, phase)
+    iterator = iter(iterator)
+    try:
+        while True:
+            with active(measurement):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+            yield item
+    except BaseException as e:
+        # Includes the consumer abandoning the stream, which closes whatever it was reading from
+        if hasattr(iterator, 'close'):
+            iterator.close()
+        end(measurement, e)
+        raise
+    end(measurement)
+
+
+async def ameasure_iter(artifact, phase: str, iterator):
+    measurement = begin(artifact, phase)
+    iterator = iterator.__aiter__()
+    try:
+        while True:
+            with active(measurement):
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+            yield item
+    except BaseException as e:
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
+        end(measurement, e)
+        raise
+    end(measurement)
+
+
+def _is_reentry(artifact, phase: str) -> bool:
+    # super() calls and async-to-sync fallbacks stay inside the measurement they started in
+    measurement = _current.get()
+    return measurement is not None and measurement.artifact is artifact and measurement.phase == phase
+
+
+def _after_output(measurement: Measurement, filepath: str):
+    for path in (filepath, os.path.splitext(filepath)[0] + '_metadata.json'):
+        if os.path.exists(path):
+            measurement.add(bytes_out=os.path.getsize(path))
+
+
+# Artifact methods that are measured, and the phase each is reported as
+PHASES = {
+    'construct': 'construct',
+    'aconstruct': 'construct',
+    'generate_data': 'generate',
+    'agenerate_data': 'generate',
+    'validate_data': 'validate',
+    'output_data_to_file': 'output'
+}
+
+
+def instrument(phase: str, fn):
+    """
+    Wrap an artifact method so each call is measured as phase and reported to the artifact's metrics sink.
+    """
+    if getattr(fn, '__instrumented__', False):
+        return fn
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            if _is_reentry(self, phase):
+                return await fn(self, *args, **kwargs)
+            with measure(self, phase):
+                return await fn(self, *args, **kwargs)
+    else:
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            if _is_reentry(self, phase):
+                return fn(self, *args, **kwargs)
+            with measure(self, phase) as measurement:
+                result = fn(self, *args, **kwargs)
+                if phase == 'output':
+                    _after_output(measurement, args[0] if args else kwargs['filepath'])
+            return result
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_class(cls):
+    """
+    Instrument the PHASES methods a class defines itself, inherited ones are already wrapped.
+    """
+    for name, phase in PHASES.items():
+        fn = cls.__dict__.get(name)
+        if fn is not None and callable(fn):
+            setattr(cls, name, instrument(phase, fn))
+
+
+class MetricsSink:
+    """
+    Receives one event dict per measured phase: artifact, provider, phase, wall_time, ok, error,
+    network_time, bytes_in, bytes_out and retries.
+    """
+    def record(self, event: dict):
+        raise NotImplementedError
+
+
+class MultiSink(MetricsSink):
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+
+    def record(self, event: dict):
+        for sink in self.sinks:
+            sink.record(event)
+
+
+class Aggregator(MetricsSink):
+    """
+    In-process totals per (artifact, provider, phase).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    def record(self, event: dict):
+        key = (event['artifact'], event['provider'], event['phase'])
+        with self._lock:
+            totals = self.totals.get(key)
+            if totals is None:
+                totals = self.totals[key] = dict(count=0, errors=0, wall_time=0.0, max_wall_time=0.0, **dict.fromkeys(COUNTERS, 0))
+            totals['count'] += 1
+            totals['errors'] += not event['ok']
+            totals['wall_time'] += event['wall_time']
+            totals['max_wall_time'] = max(totals['max_wall_time'], event['wall_time'])
+            for counter in COUNTERS:
+                totals[counter] += event[counter]
+
+    def summary(self) -> list:
+        """
+        :return: One dict per (artifact, provider, phase), the biggest consumers of wall time first.
+        """
+        with self._lock:
+            rows = [dict(artifact=artifact, provider=provider, phase=phase, **totals) for (artifact, provider, phase), totals in self.totals.items()]
+        return sorted(rows, key=lambda row: row['wall_time'], reverse=True)
+
+
+class JsonLinesSink(MetricsSink):
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def record(self, event: dict):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+class PrometheusExporter(Aggregator):
+    """
+    Aggregates events and renders them in the Prometheus text exposition format, e.g. for the
+    node_exporter textfile collector via write().
+    """
+    METRICS = (
+        ('artifact_phase_total', 'count', 'Measured calls'),
+        ('artifact_phase_errors_total', 'errors', 'Measured calls that raised'),
+        ('artifact_phase_seconds_total', 'wall_time', 'Wall time spent in the phase'),
+        ('artifact_network_seconds_total', 'network_time', 'Time spent waiting on the provider'),
+        ('artifact_bytes_in_total', 'bytes_in', 'Bytes received from the provider'),
+        ('artifact_bytes_out_total', 'bytes_out', 'Bytes sent to the provider or written to files'),
+        ('artifact_retries_total', 'retries', 'Retried provider calls')
+    )
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render(self) -> str:
+        with self._lock:
+            totals = {key: dict(value) for key, value in self.totals.items()}
+        lines = []
+        for name, field, help_text in self.METRICS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (artifact, provider, phase), values in sorted(totals.items()):
+                labels = f'artifact="{self._escape(artifact)}",provider="{self._escape(provider)}",phase="{self._escape(phase)}"'
+                lines.append(f"{name}{{{labels}}} {values[field]}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
@@ -0,0 +1,241 @@
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+import httpx
+from artifact_logger import setup_logger
+import artifact_metrics
+
+logger = setup_logger("ArtifactRateLimit")
+
+
+class RetryableError(Exception):
+    """
+    Raised by generate_data for failures worth retrying, e.g. a 429 or 503 from the provider.
+    """
+    def __init__(self, message: str, status_code: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value) -> float:
+    """
+    Seconds to wait from a Retry-After header, which is either a number of seconds or an HTTP date.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 retry_statuses: tuple = (408, 429, 500, 502, 503, 504, 529),
+                 retry_exceptions: tuple = (RetryableError, requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.retry_exceptions = retry_exceptions
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter keeps a burst of failed requests from retrying in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def check_response(self, status_code: int, headers):
+        if status_code in self.retry_statuses:
+            raise RetryableError(f"Retryable status code {status_code}", status_code, parse_retry_after(headers.get('Retry-After')))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute. Callers reserve tokens up front,
+    letting the balance go negative, and then wait outside the lock until their reservation is covered.
+    A reservation can be settled afterwards against what was actually used.
+    The same bucket can be shared by threads and coroutines.
+    """
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        :return: Seconds to wait before the reserved tokens may be spent.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def settle(self, reserved: float, used: float):
+        """
+        Give back the unused part of a reservation, or charge for going over it.
+        """
+        delta = min(reserved, self.capacity) - min(used, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate + delta)
+            self.updated = now
+
+
+class RateLimiter:
+    """
+    Shared request budget for one provider: requests per minute, optionally tokens per minute in total
+    and input and output tokens per minute on their own, and a cool-down set from Retry-After that holds
+    back every caller, not just the one that was told.
+
+    Token buckets are charged an estimate before each call, e.g. the prompt plus max_tokens, and settled
+    against the real usage once the response arrives so unused output allowance goes back to the quota.
+    """
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 input_tokens_per_minute: float = None, output_tokens_per_minute: float = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.input_tokens = TokenBucket(input_tokens_per_minute) if input_tokens_per_minute else None
+        self.output_tokens = TokenBucket(output_tokens_per_minute) if output_tokens_per_minute else None
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _token_buckets(self, input_tokens: float, output_tokens: float):
+        # (bucket, amount) for every token quota that applies
+        return [(bucket, amount) for bucket, amount in ((self.tokens, input_tokens + output_tokens), (self.input_tokens, input_tokens), (self.output_tokens, output_tokens))
+                if bucket is not None and amount]
+
+    def reserve(self, input_tokens: float = 0, output_tokens: float = 0) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        for bucket, amount in self._token_buckets(input_tokens, output_tokens):
+            wait = max(wait, bucket.reserve(amount))
+        with self._lock:
+            return max(wait, self.blocked_until - time.monotonic())
+
+    def settle(self, reserved: tuple, used: tuple):
+        """
+        Correct the token buckets from the (input, output) tokens reserved to those actually used.
+        """
+        for bucket, reserved_amount, used_amount in ((self.tokens, sum(reserved), sum(used)), (self.input_tokens, reserved[0], used[0]), (self.output_tokens, reserved[1], used[1])):
+            if bucket is not None and reserved_amount != used_amount:
+                bucket.settle(reserved_amount, used_amount)
+
+    def acquire(self, input_tokens: float = 0, output_tokens: float = 0):
+        wait = self.reserve(input_tokens, output_tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, input_tokens: float = 0, output_tokens: float = 0):
+        wait = self.reserve(input_tokens, output_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> RateLimiter:
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter()
+        return _limiters[provider]
+
+
+def configure(provider: str, requests_per_minute: float = None, tokens_per_minute: float = None,
+              input_tokens_per_minute: float = None, output_tokens_per_minute: float = None):
+    """
+    Set the quota for a provider, shared by every artifact, thread and coroutine in the process.
+    """
+    with _limiters_lock:
+        _limiters[provider] = RateLimiter(requests_per_minute, tokens_per_minute, input_tokens_per_minute, output_tokens_per_minute)
+
+
+def _after_failure(e: Exception, attempt: int, limiter: RateLimiter, policy: RetryPolicy, provider: str) -> float:
+    if attempt >= policy.max_retries:
+        logger.error(f"Giving up on {provider} after {attempt + 1} attempts: {str(e)}")
+        raise e
+    retry_after = getattr(e, 'retry_after', None)
+    if retry_after is not None:
+        limiter.pause(retry_after)
+    delay = policy.delay(attempt, retry_after)
+    logger.warning(f"Retrying {provider} request in {delay:.2f}s (attempt {attempt + 1}/{policy.max_retries}): {str(e)}")
+    return delay
+
+
+def _settle(limiter: RateLimiter, tokens: tuple, usage, result):
+    if usage is None or not any(tokens):
+        return
+    try:
+        used = usage(result)
+    except Exception as e:
+        logger.warning(f"Couldn't read token usage, keeping the estimate: {str(e)}")
+        return
+    if used is not None:
+        limiter.settle(tokens, used)
+
+
+def call_with_retry(fn, provider: str, policy: RetryPolicy, tokens: tuple = (0, 0), usage=None):
+    """
+    Call fn under the provider's rate limit, retrying retryable failures with backoff.
+
+    :param tokens: Estimated (input, output) tokens the call will consume, charged against token quotas.
+    :param usage: Optional function from fn's result to the (input, output) tokens it actually used,
+                  which the charge is corrected to.
+    """
+    limiter = get_limiter(provider)
+    attempt = 0
+    while True:
+        limiter.acquire(*tokens)
+        try:
+            with artifact_metrics.network():
+                result = fn()
+            _settle(limiter, tokens, usage, result)
+            return result
+        except policy.retry_exceptions as e:
+            # A rejected request isn't counted against the provider's quota
+            limiter.settle(tokens, (0, 0))
+            delay = _after_failure(e, attempt, limiter, policy, provider)
+        artifact_metrics.record(retries=1)
+        time.sleep(delay)
+        attempt += 1
+
+
+async def acall_with_retry(fn, provider: str, policy: RetryPolicy, tokens: tuple = (0, 0), usage=None):
+    """
+    Async counterpart of call_with_retry, fn is a zero-argument coroutine function.
+    """
+    limiter = get_limiter(provider)
+    attempt = 0
+    while True:
+        await limiter.aacquire(*tokens)
+        try:
+            with artifact_metrics.network():
+                result = await fn()
+            _settle(limiter, tokens, usage, result)
+            return result
+        except policy.retry_exceptions as e:
+            limiter.settle(tokens, (0, 0))
+            delay = _after_failure(e, attempt, limiter, policy, provider)
+        artifact_metrics.record(retries=1)
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,65 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from artifact_logger import setup_logger
+from artifact_executor import ConstructResult, begin_construct
+from artifacts import parse_html
+
+logger = setup_logger("ArtifactScrape")
+
+
+def scrape_many(artifacts, fetch_concurrency: int = 16, parse_workers: int = None) -> list:
+    """
+    Construct WebScraperArtifacts as a two stage pipeline: pages are fetched concurrently on a thread pool
+    and each one is handed to a process pool for parsing as soon as it arrives, so parsing uses every core
+    instead of queueing behind the GIL.
+
+    :param fetch_concurrency: Number of GET requests in flight at once.
+    :param parse_workers: Number of parsing processes, defaults to os.cpu_count().
+    :return: One ConstructResult per artifact, in input order. A failure never aborts the batch.
+    """
+    artifacts = list(artifacts)
+    if fetch_concurrency < 1:
+        raise ValueError("fetch_concurrency must be at least 1.")
+
+    results = [None] * len(artifacts)
+    pending = {}
+    start = time.perf_counter()
+    for index, artifact in enumerate(artifacts):
+        construction = begin_construct(artifact)
+        if isinstance(construction, ConstructResult):
+            results[index] = construction
+        else:
+            pending[index] = construction
+
+    def fetch(index):
+        with pending[index].active():
+            return artifacts[index].fetch(artifacts[index].prompt["url"])
+
+    logger.info(f"Scraping {len(pending)} pages")
+    with ThreadPoolExecutor(max_workers=fetch_concurrency) as fetchers, ProcessPoolExecutor(max_workers=parse_workers or os.cpu_count()) as parsers:
+        fetches = {fetchers.submit(fetch, index): index for index in pending}
+        parses = {}
+        for future in as_completed(fetches):
+            index = fetches[future]
+            try:
+                response = future.result()
+            except Exception as e:
+                results[index] = pending[index].fail(e)
+                continue
+            parse = parsers.submit(parse_html, response.text, artifacts[index].parser)
+            parses[parse] = (index, response.status_code, response.headers.get('Content-Type'))
+
+        for future in as_completed(parses):
+            index, status_code, content_type = parses[future]
+            artifact = artifacts[index]
+            try:
+                data, metadata = artifact._scrape_result(artifact.prompt["url"], status_code, content_type, future.result())
+            except Exception as e:
+                results[index] = pending[index].fail(e)
+                continue
+            results[index] = pending[index].finish(data, metadata)
+
+    failures = sum(1 for result in results if not result.ok)
+    logger.info(f"Scraped {len(results) - failures}/{len(results)} pages in {time.perf_counter() - start:.2f}s")
+    return results
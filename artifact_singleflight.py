@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key: the first caller (the leader) runs the function and
+    every caller arriving while it is in flight waits for and shares its result or exception.
+    Works across threads and event loops, sync and async callers can share the same call.
+    Nothing is remembered once the call completes, that is the cache's job.
+
+    A share function can turn the leader's result into what waiters receive, e.g. to replace handles
+    on files only the leader owns. It is only called when somebody actually waited.
+    """
+    def __init__(self):
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _join(self, key: str):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                call[1] += 1
+                return call[0], False
+            future = Future()
+            # [future, number of waiters]
+            self._calls[key] = [future, 0]
+            return future, True
+
+    def _finish(self, key: str, future: Future, result=None, error: BaseException = None, share=None):
+        with self._lock:
+            waiters = self._calls.pop(key)[1]
+        if error is not None:
+            future.set_exception(error)
+            return
+        if share is not None and waiters:
+            try:
+                result = share(result)
+            except BaseException as e:
+                future.set_exception(e)
+                return
+        future.set_result(result)
+
+    def do(self, key: str, fn, share=None):
+        """
+        :param share: Optional function from the leader's result to what the waiters get.
+        :return: (result, shared) where shared is True if another caller produced the result.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result, share=share)
+        return result, False
+
+    async def ado(self, key: str, fn, share=None):
+        """
+        Async counterpart of do, fn is a zero-argument coroutine function.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result, share=share)
+        return result, False
+
+    def __len__(self):
+        return len(self._calls)
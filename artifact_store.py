@@ -0,0 +1,221 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+from artifact import Artifact
+from artifact_logger import setup_logger
+
+
+class Blob:
+    """
+    Lazy handle on a byte range of a file. Nothing is read until the bytes are asked for,
+    and then the file is memory-mapped rather than read through a buffer.
+    """
+    def __init__(self, path: str, offset: int = 0, length: int = None):
+        self.path = path
+        self.offset = offset
+        self.length = os.path.getsize(path) - offset if length is None else length
+
+    def __len__(self):
+        return self.length
+
+    def read(self) -> bytes:
+        if self.length == 0:
+            return b''
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[self.offset:self.offset + self.length]
+
+    def __bytes__(self):
+        return self.read()
+
+    @contextmanager
+    def mapped(self):
+        """
+        Zero-copy memoryview over the blob, valid only inside the with block.
+        """
+        if self.length == 0:
+            yield memoryview(b'')
+            return
+        with open(self.path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)[self.offset:self.offset + self.length]
+        try:
+            yield view
+        finally:
+            view.release()
+            mapped.close()
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise ValueError(f"Blob file {self.path} is shorter than expected")
+                remaining -= len(chunk)
+                yield chunk
+
+    def __repr__(self):
+        return f"Blob(path={self.path}, offset={self.offset}, length={self.length})"
+
+
+def is_binary(value) -> bool:
+    return isinstance(value, (bytes, Blob))
+
+
+def iter_binary(value, chunk_size: int = 1024 * 1024):
+    """
+    Iterate over bytes or a Blob in chunks, without materializing a Blob.
+    """
+    if isinstance(value, Blob):
+        yield from value.iter_chunks(chunk_size)
+        return
+    view = memoryview(value)
+    for offset in range(0, len(view), chunk_size):
+        yield bytes(view[offset:offset + chunk_size])
+
+
+class ArtifactStore:
+    """
+    Stores each artifact as a compact JSON manifest (class, prompt, tags, metadata and data)
+    in which every bytes value is replaced by a reference to a raw blob named by its SHA-256.
+    Identical payloads are only ever written once.
+
+    Layout:
+        <root>/manifests/<artifact id>.json
+        <root>/blobs/<sha256[:2]>/<sha256>
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.logger = setup_logger(self.__class__.__name__)
+        os.makedirs(os.path.join(root, 'manifests'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+
+    def _manifest_path(self, artifact_id: str) -> str:
+        return os.path.join(self.root, 'manifests', quote(artifact_id, safe='') + '.json')
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def _write_atomic(self, path: str, content: bytes):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def put_blob(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_atomic(path, content)
+        return digest
+
+    def _blob_digest(self, blob: Blob):
+        # Whole-file blobs already living in this store don't need to be read back to be referenced
+        digest = os.path.basename(blob.path)
+        if blob.offset == 0 and os.path.abspath(blob.path) == os.path.abspath(self.blob_path(digest)):
+            return digest
+        return self.put_blob(blob.read())
+
+    def offload(self, value, threshold: int = 0):
+        """
+        Replace bytes values of at least threshold bytes, at any depth, with Blob handles into this store.
+        """
+        if isinstance(value, bytes) and len(value) >= threshold:
+            return Blob(self.blob_path(self.put_blob(value)), length=len(value))
+        if isinstance(value, dict):
+            return {key: self.offload(item, threshold) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.offload(item, threshold) for item in value]
+        return value
+
+    def _pack(self, value):
+        if isinstance(value, Blob):
+            return {'$blob': self._blob_digest(value), 'size': len(value)}
+        if isinstance(value, bytes):
+            return {'$blob': self.put_blob(value), 'size': len(value)}
+        if isinstance(value, dict):
+            return {key: self._pack(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._pack(item) for item in value]
+        return value
+
+    def _unpack(self, value, lazy: bool):
+        if isinstance(value, dict):
+            if '$blob' in value:
+                blob = Blob(self.blob_path(value['$blob']), length=value['size'])
+                return blob if lazy else blob.read()
+            return {key: self._unpack(item, lazy) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._unpack(item, lazy) for item in value]
+        return value
+
+    def save(self, artifact: Artifact, artifact_id: str = None) -> str:
+        """
+        Save a constructed artifact.
+
+        :param artifact_id: Name to store it under, defaults to the artifact's cache_key().
+        :return: The id to pass to load().
+        """
+        if not artifact.constructed:
+            raise ValueError("Artifact must be constructed before it can be stored.")
+
+        artifact_id = artifact_id or artifact.cache_key()
+        payload_data = artifact.payload_data
+        try:
+            json.dumps(payload_data)
+        except (TypeError, OverflowError, ValueError):
+            self.logger.warning(f"Payload data of {artifact_id} is not JSON serializable and will not be stored")
+            payload_data = None
+
+        manifest = {
+            'class': artifact.__class__.__name__,
+            'prompt': artifact.prompt,
+            'payload_data': payload_data,
+            'mandatory_tags': artifact.mandatory_tags,
+            'optional_tags': artifact.optional_tags,
+            'metadata': artifact.metadata,
+            'data': self._pack(artifact.data),
+            'stored_at': time.time()
+        }
+        self._write_atomic(self._manifest_path(artifact_id), json.dumps(manifest, separators=(',', ':')).encode('utf-8'))
+        self.logger.info(f"Stored {manifest['class']} as {artifact_id}")
+        return artifact_id
+
+    def load_manifest(self, artifact_id: str) -> dict:
+        try:
+            with open(self._manifest_path(artifact_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(f"No stored artifact with id {artifact_id}")
+
+    def load(self, artifact_id: str, lazy: bool = True) -> Artifact:
+        """
+        Rebuild a stored artifact through the constructed=True constructor path.
+
+        :param lazy: Hand binary values back as Blob handles that are only mapped when read.
+        """
+        manifest = self.load_manifest(artifact_id)
+        cls = Artifact.registry.get(manifest['class'])
+        if cls is None:
+            raise ValueError(f"Unknown artifact class {manifest['class']}, is the module defining it imported?")
+
+        return cls(
+            manifest['prompt'],
+            manifest['payload_data'],
+            mandatory_tags=manifest['mandatory_tags'],
+            optional_tags=manifest['optional_tags'],
+            data=self._unpack(manifest['data'], lazy),
+            metadata=manifest['metadata'],
+            constructed=True
+        )
+
+    def exists(self, artifact_id: str) -> bool:
+        return os.path.exists(self._manifest_path(artifact_id))
@@ -0,0 +1,254 @@
+import bisect
+import heapq
+from artifact import MediaMixin, GraphicalMixin
+from artifact_logger import setup_logger
+
+logger = setup_logger("ArtifactTimeline")
+
+
+class IntervalIndex:
+    """
+    Static interval tree over half-open [start, end) intervals. Intervals are kept sorted by start
+    and viewed as an implicit balanced tree over that array, each node holding the largest end in its
+    subtree, so stabbing and window queries cost O(log n + k). Adding marks the index dirty and the
+    max-end array is rebuilt in O(n) on the next query. Many intervals at once go through extend, which
+    sorts once instead of inserting each one.
+    """
+    def __init__(self):
+        self._starts = []
+        self._entries = []
+        self._max_end = []
+        self._dirty = False
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, start, end, value):
+        # The counter keeps insertion order among equal starts and avoids comparing values
+        entry = (start, self._counter, end, value)
+        self._counter += 1
+        index = bisect.bisect_right(self._starts, start)
+        self._starts.insert(index, start)
+        self._entries.insert(index, entry)
+        self._dirty = True
+
+    def extend(self, intervals):
+        """
+        Add (start, end, value) triples in O((n + k) log(n + k)), e.g. when building a timeline from unsorted clips.
+        """
+        count = len(self._entries)
+        for start, end, value in intervals:
+            self._entries.append((start, self._counter, end, value))
+            self._counter += 1
+        if len(self._entries) == count:
+            return
+        # The counter is unique, so the sort never has to compare values
+        self._entries.sort(key=lambda entry: (entry[0], entry[1]))
+        self._starts = [entry[0] for entry in self._entries]
+        self._dirty = True
+
+    def _build(self, lo: int, hi: int) -> float:
+        if lo >= hi:
+            return float('-inf')
+        mid = (lo + hi) // 2
+        self._max_end[mid] = max(self._entries[mid][2], self._build(lo, mid), self._build(mid + 1, hi))
+        return self._max_end[mid]
+
+    def _ensure_built(self):
+        if self._dirty:
+            self._max_end = [None] * len(self._entries)
+            self._build(0, len(self._entries))
+            self._dirty = False
+
+    def _search(self, lo: int, hi: int, start, end, found: list):
+        # Collects entries with entry.start < end (entry.start <= start when end is None) and entry.end > start,
+        # walking the same implicit tree _build laid out
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self._max_end[mid] <= start:
+            return
+        self._search(lo, mid, start, end, found)
+        entry = self._entries[mid]
+        if (entry[0] <= start) if end is None else (entry[0] < end):
+            if entry[2] > start:
+                found.append(entry)
+            self._search(mid + 1, hi, start, end, found)
+
+    def overlapping(self, start, end) -> list:
+        """
+        :return: (start, end, value) of every interval overlapping [start, end), ordered by start.
+        """
+        self._ensure_built()
+        found = []
+        self._search(0, len(self._entries), start, end, found)
+        return [(entry[0], entry[2], entry[3]) for entry in found]
+
+    def max_end(self):
+        self._ensure_built()
+        return self._max_end[len(self._entries) // 2] if self._entries else None
+
+    def stab(self, point) -> list:
+        """
+        :return: (start, end, value) of every interval containing point.
+        """
+        self._ensure_built()
+        found = []
+        self._search(0, len(self._entries), point, None, found)
+        return [(entry[0], entry[2], entry[3]) for entry in found]
+
+    def iter_from(self, start):
+        """
+        Iterate (start, end, value) in start order beginning with the first interval starting at or after start.
+        """
+        for index in range(bisect.bisect_left(self._starts, start), len(self._entries)):
+            entry = self._entries[index]
+            yield entry[0], entry[2], entry[3]
+
+
+class Timeline:
+    """
+    Index of MediaMixin artifacts by their start_time/end_time, for assembling long productions.
+    Clips are active over [start_time, end_time).
+
+    :param track: Optional function from artifact to track name. Overlaps are only reported between
+                  clips on the same track, and gaps can be asked for per track, e.g. to keep a narration
+                  track continuous while images layer freely on top.
+    """
+    def __init__(self, artifacts=(), track=None):
+        self.track = track
+        self._index = IntervalIndex()
+        self._tracks = {}
+        self.extend(artifacts)
+
+    @staticmethod
+    def _interval(artifact):
+        if not isinstance(artifact, MediaMixin) or 'start_time' not in artifact.mandatory_tags or 'end_time' not in artifact.mandatory_tags:
+            raise ValueError(f"{artifact.__class__.__name__} is not a media artifact with a start_time and end_time.")
+        start, end = artifact.start_time, artifact.end_time
+        if end < start:
+            raise ValueError(f"{artifact.__class__.__name__} ends at {end} before it starts at {start}.")
+        return start, end, artifact
+
+    def add(self, artifact):
+        start, end, artifact = self._interval(artifact)
+        self._index.add(start, end, artifact)
+        if self.track is not None:
+            self._tracks.setdefault(self.track(artifact), IntervalIndex()).add(start, end, artifact)
+
+    def extend(self, artifacts):
+        """
+        Add many artifacts with one sort per index rather than an insert per artifact.
+        """
+        intervals = [self._interval(artifact) for artifact in artifacts]
+        self._index.extend(intervals)
+        if self.track is not None:
+            by_track = {}
+            for interval in intervals:
+                by_track.setdefault(self.track(interval[2]), []).append(interval)
+            for track, track_intervals in by_track.items():
+                self._tracks.setdefault(track, IntervalIndex()).extend(track_intervals)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return (artifact for _, _, artifact in self._index.iter_from(float('-inf')))
+
+    def _index_for(self, track) -> IntervalIndex:
+        if track is None:
+            return self._index
+        if self.track is None:
+            raise ValueError("This timeline has no tracks.")
+        return self._tracks.get(track) or IntervalIndex()
+
+    @property
+    def start_time(self):
+        return next(self._index.iter_from(float('-inf')), (None,))[0]
+
+    @property
+    def end_time(self):
+        return self._index.max_end()
+
+    def at(self, t, track=None) -> list:
+        """
+        :return: The artifacts active at time t, ordered by start time.
+        """
+        return [artifact for _, _, artifact in self._index_for(track).stab(t)]
+
+    def window(self, start, end, track=None) -> list:
+        """
+        :return: The artifacts active at any point in [start, end), ordered by start time.
+        """
+        return [artifact for _, _, artifact in self._index_for(track).overlapping(start, end)]
+
+    def overlaps(self):
+        """
+        Yield (first, second, overlap_start, overlap_end) for every pair of clips on the same track
+        that play at the same time, by sweeping the clips in start order.
+        """
+        active = {}
+        for start, end, artifact in self._index.iter_from(float('-inf')):
+            track = self.track(artifact) if self.track is not None else None
+            heap = active.setdefault(track, [])
+            while heap and heap[0][0] <= start:
+                heapq.heappop(heap)
+            for other_end, _, other in heap:
+                if min(end, other_end) > start:
+                    yield other, artifact, start, min(end, other_end)
+            heapq.heappush(heap, (end, id(artifact), artifact))
+
+    def gaps(self, start=None, end=None, track=None) -> list:
+        """
+        :return: (gap_start, gap_end) for every stretch of [start, end) where no clip is active.
+                 start and end default to the bounds of the timeline.
+        """
+        index = self._index_for(track)
+        start = self.start_time if start is None else start
+        end = self.end_time if end is None else end
+        if start is None or end is None:
+            return []
+
+        gaps = []
+        covered_until = start
+        for clip_start, clip_end, _ in index.overlapping(start, end):
+            if clip_start > covered_until:
+                gaps.append((covered_until, clip_start))
+            covered_until = max(covered_until, clip_end)
+        if covered_until < end:
+            gaps.append((covered_until, end))
+        return gaps
+
+    def manifest(self, start=None, end=None):
+        """
+        Lazily yield a render entry per clip active in [start, end), in start order. Clips already
+        playing at start come first, nothing past the last needed clip is visited.
+        """
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+        for clip_start, clip_end, artifact in self._index.stab(start):
+            if clip_start < start:
+                yield self._manifest_entry(clip_start, clip_end, artifact)
+        for clip_start, clip_end, artifact in self._index.iter_from(start):
+            if clip_start >= end:
+                return
+            yield self._manifest_entry(clip_start, clip_end, artifact)
+
+    def _manifest_entry(self, start, end, artifact) -> dict:
+        entry = {
+            'start_time': start,
+            'end_time': end,
+            'class': artifact.__class__.__name__,
+            'cache_key': artifact.cache_key(),
+            'constructed': artifact.constructed
+        }
+        if self.track is not None:
+            entry['track'] = self.track(artifact)
+        # Graphical tags are only present when the artifact was built with them
+        if isinstance(artifact, GraphicalMixin):
+            if 'position_x' in artifact.mandatory_tags and 'position_y' in artifact.mandatory_tags:
+                entry['position'] = artifact.position
+            if 'resolution' in artifact.prompt:
+                entry['resolution'] = artifact.resolution
+        return entry
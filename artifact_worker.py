@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import importlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from artifact import Artifact
+from artifact_logger import setup_logger
+from artifact_executor import ConstructResult
+from artifact_store import ArtifactStore
+
+logger = setup_logger("ArtifactWorker")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    class TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    payload_data TEXT,
+    mandatory_tags TEXT NOT NULL,
+    optional_tags TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, created);
+"""
+
+
+class WorkQueue:
+    """
+    Queue of artifact construction requests in a SQLite file, shared by the submitter and any number
+    of worker processes on the same host. The file is opened in WAL mode, which relies on shared memory,
+    so it must be on a local disk rather than a network filesystem. A job is an artifact's
+    class name, prompt, payload and tags, keyed by its cache_key so resubmitting the same artifact is free.
+
+    Workers lease the jobs they claim. A job whose lease runs out, because its worker died, goes back
+    to being claimable, and one that keeps failing is given up on after max_attempts.
+    """
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.row_factory = sqlite3.Row
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front so two workers can't claim the same job
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def submit(self, artifact: Artifact) -> str:
+        """
+        :return: The job id, which is also the id the result is stored under.
+        """
+        try:
+            payload_data = json.dumps(artifact.payload_data)
+        except (TypeError, OverflowError, ValueError):
+            raise ValueError("Payload data must be JSON serializable to be sent to a worker.")
+
+        job_id = artifact.cache_key()
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO jobs (id, class, prompt, payload_data, mandatory_tags, optional_tags, status, max_attempts, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, artifact.__class__.__name__, json.dumps(artifact.prompt), payload_data, json.dumps(artifact.mandatory_tags),
+                 json.dumps(artifact.optional_tags), PENDING, self.max_attempts, now, now))
+            # Resubmitting a job that gave up gives it a fresh set of attempts
+            connection.execute("UPDATE jobs SET status = ?, attempts = 0, error = NULL, updated = ? WHERE id = ? AND status = ?", (PENDING, now, job_id, FAILED))
+        return job_id
+
+    def claim(self, worker_id: str, lease_seconds: float = 60.0):
+        """
+        Lease the oldest claimable job to worker_id.
+
+        :return: The job as a dict, or None if there is nothing to do.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            while True:
+                row = connection.execute(
+                    "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY created LIMIT 1",
+                    (PENDING, RUNNING, now)).fetchone()
+                if row is None:
+                    return None
+                if row["status"] == RUNNING:
+                    logger.warning("Lease of %s on job %s expired, reclaiming it", row['lease_owner'], row['id'])
+                if row["attempts"] < row["max_attempts"]:
+                    break
+                connection.execute("UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated = ? WHERE id = ?",
+                                   (FAILED, row["error"] or "Lease expired on the last attempt", now, row["id"]))
+            connection.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?, updated = ? WHERE id = ?",
+                               (RUNNING, worker_id, now + lease_seconds, now, row["id"]))
+        return dict(row)
+
+    def renew(self, job_id: str, worker_id: str, lease_seconds: float = 60.0) -> bool:
+        """
+        Extend a lease. False means the lease was lost to another worker.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                                        (time.time() + lease_seconds, job_id, RUNNING, worker_id))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str) -> bool:
+        """
+        Mark a job done. False means the lease was lost and the job belongs to another worker now.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute("UPDATE jobs SET status = ?, lease_owner = NULL, error = NULL, updated = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                                        (DONE, time.time(), job_id, RUNNING, worker_id))
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str):
+        with self._transaction() as connection:
+            row = connection.execute("SELECT attempts, max_attempts, lease_owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["lease_owner"] != worker_id:
+                return
+            status = FAILED if row["attempts"] >= row["max_attempts"] else PENDING
+            connection.execute("UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated = ? WHERE id = ?",
+                               (status, error, time.time(), job_id))
+
+    def job(self, job_id: str) -> dict:
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No job with id {job_id}")
+        return dict(row)
+
+    def counts(self) -> dict:
+        with self._connect() as connection:
+            rows = connection.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        counts.update({row["status"]: row["count"] for row in rows})
+        return counts
+
+    def wait(self, job_ids, timeout: float = None, poll_interval: float = 0.5) -> dict:
+        """
+        Block until every job is done or failed.
+
+        :return: job id -> job dict.
+        """
+        remaining = set(job_ids)
+        finished = {}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._connect() as connection:
+                for job_id in list(remaining):
+                    row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                    if row is None:
+                        raise KeyError(f"No job with id {job_id}")
+                    if row["status"] in (DONE, FAILED):
+                        finished[job_id] = dict(row)
+                        remaining.discard(job_id)
+            if not remaining:
+                return finished
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{len(remaining)} jobs did not finish within {timeout} seconds")
+            time.sleep(poll_interval)
+
+
+def _job_artifact(job: dict) -> Artifact:
+    cls = Artifact.registry.get(job["class"])
+    if cls is None:
+        raise ValueError(f"Unknown artifact class {job['class']}, is the module defining it imported?")
+    return cls(
+        json.loads(job["prompt"]),
+        json.loads(job["payload_data"]) if job["payload_data"] is not None else None,
+        mandatory_tags=json.loads(job["mandatory_tags"]),
+        optional_tags=json.loads(job["optional_tags"])
+    )
+
+
+class Worker:
+    """
+    Claims jobs from a WorkQueue, constructs them and saves the results into an ArtifactStore
+    under the job id. The lease is renewed in the background for as long as a construction runs.
+    """
+    def __init__(self, queue: WorkQueue, store: ArtifactStore, worker_id: str = None, lease_seconds: float = 60.0, poll_interval: float = 0.5):
+        self.queue = queue
+        self.store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.processed = 0
+
+    def _keep_leased(self, job_id: str, stop: threading.Event):
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.queue.renew(job_id, self.worker_id, self.lease_seconds):
+                logger.warning("Worker %s lost the lease on job %s", self.worker_id, job_id)
+                return
+
+    def run_job(self, job: dict):
+        job_id = job["id"]
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_leased, args=(job_id, stop), daemon=True)
+        heartbeat.start()
+        start = time.perf_counter()
+        try:
+            artifact = _job_artifact(job)
+            artifact.construct()
+            self.store.save(artifact, job_id)
+        except Exception as e:
+            logger.error("Job %s (%s) failed on attempt %s: %s", job_id, job['class'], job['attempts'] + 1, e)
+            self.queue.fail(job_id, self.worker_id, f"{type(e).__name__}: {str(e)}")
+            return
+        finally:
+            stop.set()
+            heartbeat.join()
+        if not self.queue.complete(job_id, self.worker_id):
+            logger.warning("Worker %s finished job %s after losing its lease, leaving it to the new owner", self.worker_id, job_id)
+            return
+        logger.info("Job %s (%s) done in %.2fs", job_id, job['class'], time.perf_counter() - start)
+
+    def run(self, max_jobs: int = None, idle_timeout: float = None):
+        """
+        Process jobs until max_jobs have been handled or the queue has been empty for idle_timeout seconds.
+        Both default to running forever.
+        """
+        logger.info("Worker %s started", self.worker_id)
+        idle_since = time.monotonic()
+        while max_jobs is None or self.processed < max_jobs:
+            job = self.queue.claim(self.worker_id, self.lease_seconds)
+            if job is None:
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+            self.run_job(job)
+            self.processed += 1
+            idle_since = time.monotonic()
+        logger.info("Worker %s stopped after %s jobs", self.worker_id, self.processed)
+
+
+def _worker_main(queue_path: str, store_root: str, modules, max_jobs, idle_timeout, lease_seconds, poll_interval):
+    for module in modules:
+        importlib.import_module(module)
+    worker = Worker(WorkQueue(queue_path), ArtifactStore(store_root), lease_seconds=lease_seconds, poll_interval=poll_interval)
+    worker.run(max_jobs, idle_timeout)
+
+
+def start_workers(queue_path: str, store_root: str, processes: int = None, modules=("artifacts",), max_jobs: int = None,
+                  idle_timeout: float = None, lease_seconds: float = 60.0, poll_interval: float = 0.5) -> list:
+    """
+    Start worker processes on this machine.
+
+    :param modules: Modules each worker imports so the artifact classes it will be asked for are registered.
+    :return: The started multiprocessing.Process objects.
+    """
+    workers = []
+    for _ in range(processes or os.cpu_count()):
+        process = multiprocessing.Process(target=_worker_main, args=(queue_path, store_root, tuple(modules), max_jobs, idle_timeout, lease_seconds, poll_interval), daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def construct_distributed(artifacts, queue: WorkQueue, store: ArtifactStore, timeout: float = None, poll_interval: float = 0.5) -> list:
+    """
+    Submit artifacts to the queue and wait for workers to construct them.
+
+    :return: One ConstructResult per artifact, in input order. Constructed artifacts are loaded from the store.
+    """
+    artifacts = list(artifacts)
+    start = time.perf_counter()
+    job_ids = [queue.submit(artifact) for artifact in artifacts]
+    logger.info("Submitted %s jobs for %s artifacts", len(set(job_ids)), len(artifacts))
+    jobs = queue.wait(job_ids, timeout, poll_interval)
+
+    results = []
+    for artifact, job_id in zip(artifacts, job_ids):
+        job = jobs[job_id]
+        elapsed = job["updated"] - job["created"]
+        if job["status"] == DONE:
+            results.append(ConstructResult(store.load(job_id), elapsed=elapsed))
+        else:
+            results.append(ConstructResult(artifact, RuntimeError(f"Job {job_id} failed after {job['attempts']} attempts: {job['error']}"), elapsed))
+
+    failures = sum(1 for result in results if not result.ok)
+    logger.info("Constructed %s/%s artifacts in %.2fs", len(results) - failures, len(results), time.perf_counter() - start)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run artifact workers against a shared queue and store.")
+    parser.add_argument("--queue", required=True, help="Path of the SQLite work queue")
+    parser.add_argument("--store", required=True, help="Root directory of the ArtifactStore results are saved to")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Worker processes to run")
+    parser.add_argument("--module", action="append", default=None, help="Module defining artifact classes, may be repeated")
+    parser.add_argument("--lease", type=float, default=60.0, help="Seconds a claimed job stays leased without a heartbeat")
+    parser.add_argument("--idle-timeout", type=float, default=None, help="Exit after the queue has been empty this long")
+    args = parser.parse_args(argv)
+
+    workers = start_workers(args.queue, args.store, args.processes, args.module or ["artifacts"], idle_timeout=args.idle_timeout, lease_seconds=args.lease)
+    for process in workers:
+        process.join()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
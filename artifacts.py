@@ -1,66 +1,354 @@
 from artifact import Artifact, MediaMixin, GraphicalMixin
-import requests
 from bs4 import BeautifulSoup
-from artifact_logger import setup_logger
+from artifact_store import Blob, is_binary, iter_binary
+from artifact_ratelimit import RetryableError
+import artifact_metrics
+from artifact_http import get_session, get_async_client, get_anthropic_client, get_async_anthropic_client, provider_url
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urljoin, urldefrag, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
 from typing import Any
 import os 
 import json
-import tempfile
-from mutagen.mp3 import MP3
+import io
+import threading
+import asyncio
+import contextvars
+import re
 import anthropic
+from mutagen.mp3 import MP3
+try:
+    import lxml
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+def parse_html(text: str, parser: str = 'html.parser'):
+    """
+    Extract the title and paragraph texts from a page. Kept at module level so it can run in a process pool.
+    """
+    soup = BeautifulSoup(text, parser)
+    title = soup.title.text if soup.title else None
+    paragraphs = [p.text for p in soup.find_all('p')]
+    return title, paragraphs
+
+def parse_page(text, parser: str = 'html.parser'):
+    """
+    Like parse_html, but also returns the href of every link on the page.
+    """
+    soup = BeautifulSoup(text, parser)
+    title = soup.title.text if soup.title else None
+    paragraphs = [p.text for p in soup.find_all('p')]
+    links = [a['href'] for a in soup.find_all('a', href=True)]
+    return title, paragraphs, links
+
 class WebScraperArtifact(Artifact):
-    def __init__(self, *args, user_agent: str = 'Mozilla/5.0', **kwargs):
-        super().__init__(*args, **kwargs)
+    __slots__ = ('user_agent', 'parser')
+    provider = "web"
+
+    def __init__(self, *args, user_agent: str = 'Mozilla/5.0', parser: str = 'html.parser', **kwargs):
         self.user_agent = user_agent
-        self.logger = setup_logger(self.__class__.__name__)
+        if parser == 'lxml' and not HAS_LXML:
+            self.logger.warning("lxml is not installed, falling back to html.parser")
+            parser = 'html.parser'
+        self.parser = parser
+        super().__init__(*args, **kwargs)
 
     @classmethod
     def build(cls, url: str, user_agent: str = 'Mozilla/5.0', payload_data=None, **kwargs):
         prompt_dict = {"url": url}
         return cls(prompt_dict, payload_data, user_agent=user_agent, **kwargs)
 
+    def _request_headers(self):
+        return {'User-Agent': self.user_agent}
+
+    def _check_status(self, status_code: int):
+        if status_code != 200:
+            self.logger.error("Failed to scrape the webpage. Status code: %s", status_code)
+            raise RuntimeError(f"Failed to scrape the webpage. Status code: {status_code}")
+
+    def _scrape_result(self, url: str, status_code: int, content_type: str, parsed: tuple):
+        title, paragraphs = parsed
+        
+        data = {
+            'title': title,
+            'paragraphs': paragraphs
+        }
+        
+        metadata = {
+            'url': url,
+            'status_code': status_code,
+            'content_type': content_type
+        }
+        
+        self.logger.info("Data and metadata generated successfully.")
+        return data, metadata
+
+    def fetch(self, url: str):
+        """
+        GET a page under the provider's rate limit and retry policy.
+        """
+        self.logger.info("Sending GET request to %s", url)
+
+        def get():
+            response = get_session(self.provider).get(url, headers=self._request_headers())
+            self.retry_policy.check_response(response.status_code, response.headers)
+            return response
+
+        response = self._call_provider(get)
+        artifact_metrics.record(bytes_in=len(response.content))
+        self._check_status(response.status_code)
+        return response
+
+    async def afetch(self, url: str):
+        self.logger.info("Sending async GET request to %s", url)
+
+        async def get():
+            response = await get_async_client(self.provider).get(url, headers=self._request_headers())
+            self.retry_policy.check_response(response.status_code, response.headers)
+            return response
+
+        response = await self._acall_provider(get)
+        artifact_metrics.record(bytes_in=len(response.content))
+        self._check_status(response.status_code)
+        return response
+
     def generate_data(self, prompt: dict, payload_data):
         url = prompt["url"]
-        headers = {'User-Agent': self.user_agent}
-        self.logger.info(f"Sending GET request to {url}")
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            self.logger.info("Request successful. Parsing HTML content.")
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            title = soup.title.text if soup.title else None
-            paragraphs = [p.text for p in soup.find_all('p')]
-            
-            data = {
-                'title': title,
-                'paragraphs': paragraphs
-            }
-            
-            metadata = {
-                'url': url,
-                'status_code': response.status_code,
-                'content_type': response.headers.get('Content-Type')
-            }
-            
-            self.logger.info("Data and metadata generated successfully.")
-            return data, metadata
-        else:
-            self.logger.error(f"Failed to scrape the webpage. Status code: {response.status_code}")
-            raise RuntimeError(f"Failed to scrape the webpage. Status code: {response.status_code}")
+        response = self.fetch(url)
+        self.logger.info("Request successful. Parsing HTML content.")
+        return self._scrape_result(url, response.status_code, response.headers.get('Content-Type'), parse_html(response.text, self.parser))
+
+    async def agenerate_data(self, prompt: dict, payload_data):
+        url = prompt["url"]
+        response = await self.afetch(url)
+        self.logger.info("Request successful. Parsing HTML content.")
+        # Parsing a large page takes long enough to stall every other task on the loop
+        text = await asyncio.to_thread(parse_html, response.text, self.parser)
+        return self._scrape_result(url, response.status_code, response.headers.get('Content-Type'), text)
 
 class MediaWebScraperArtifact(WebScraperArtifact, MediaMixin):
-    pass
-class StabilityArtifact(Artifact, GraphicalMixin):
-    def __init__(self, *args, **kwargs):
-        self.logger = setup_logger(self.__class__.__name__)
+    __slots__ = ()
+
+class CrawlerArtifact(WebScraperArtifact):
+    """
+    Crawls a site breadth-first from a start URL, following links up to max_depth. The frontier is a
+    deduplicated queue, fetches run concurrently with a cap per host, robots.txt is honoured and
+    pages over max_page_bytes or that aren't HTML are skipped.
+    """
+    __slots__ = ('max_concurrency', 'per_host_concurrency', 'respect_robots', '_robots', '_robots_lock')
+    MAX_PAGE_BYTES = 2 * 1024 * 1024
+
+    def __init__(self, *args, max_concurrency: int = 16, per_host_concurrency: int = 4, respect_robots: bool = True, **kwargs):
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.respect_robots = respect_robots
+        self._robots = {}
+        self._robots_lock = threading.Lock()
         super().__init__(*args, **kwargs)
-        
+
+    @classmethod
+    def build(cls, url: str, max_depth: int = 2, max_pages: int = 100, same_host: bool = True, max_page_bytes: int = None, user_agent: str = 'Mozilla/5.0', payload_data=None, **kwargs):
+        prompt_dict = {
+            "url": url,
+            "max_depth": max_depth,
+            "max_pages": max_pages,
+            "same_host": same_host,
+            "max_page_bytes": max_page_bytes or cls.MAX_PAGE_BYTES
+        }
+        return cls(prompt_dict, payload_data, user_agent=user_agent, **kwargs)
+
+    @staticmethod
+    def normalize_url(url: str):
+        """
+        Canonical form used to deduplicate the frontier, or None for links that can't be crawled.
+        """
+        url, _ = urldefrag(url)
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            return None
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+    def _allowed(self, url: str) -> bool:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self._robots_lock:
+            robots = self._robots.get(origin)
+        if robots is None:
+            robots = RobotFileParser()
+            try:
+                response = get_session(self.provider).get(origin + "/robots.txt", headers=self._request_headers())
+                # A missing or unreadable robots.txt allows everything
+                robots.parse(response.text.splitlines() if response.status_code == 200 else [])
+            except Exception as e:
+                self.logger.warning("Could not fetch robots.txt for %s: %s", origin, e)
+                robots.parse([])
+            with self._robots_lock:
+                self._robots[origin] = robots
+        return robots.can_fetch(self.user_agent, url)
+
+    def _fetch_page(self, url: str, max_page_bytes: int):
+        """
+        :return: (skip_reason, final_url, status_code, content_type, content) where skip_reason is None for
+                 a fetched page and final_url is where any redirects ended up.
+        """
+        if self.respect_robots and not self._allowed(url):
+            return "robots", url, None, None, None
+
+        def get():
+            response = get_session(self.provider).get(url, headers=self._request_headers(), stream=True)
+            try:
+                self.retry_policy.check_response(response.status_code, response.headers)
+            except RetryableError:
+                response.close()
+                raise
+            return response
+
+        with self._call_provider(get) as response:
+            self._check_status(response.status_code)
+            content_type = response.headers.get('Content-Type', '')
+            if 'html' not in content_type:
+                return "content_type", response.url, response.status_code, content_type, None
+            if int(response.headers.get('Content-Length') or 0) > max_page_bytes:
+                return "size", response.url, response.status_code, content_type, None
+
+            content = bytearray()
+            for chunk in artifact_metrics.timed_iter(response.iter_content(chunk_size=64 * 1024)):
+                content.extend(chunk)
+                if len(content) > max_page_bytes:
+                    return "size", response.url, response.status_code, content_type, None
+        # BeautifulSoup works out the encoding from the bytes
+        return None, response.url, response.status_code, content_type, bytes(content)
+
+    def crawl(self, prompt: dict, stats: dict = None):
+        """
+        Yield each page as {url, depth, title, paragraphs} as soon as it has been fetched and parsed.
+
+        :param stats: Optional dict that receives skip counts and per-page errors.
+        """
+        stats = stats if stats is not None else {}
+        stats.update({"errors": [], "skipped": {"robots": 0, "content_type": 0, "size": 0}})
+        root = self.normalize_url(prompt["url"])
+        if root is None:
+            raise ValueError(f"Can't crawl {prompt['url']}")
+        root_host = urlsplit(root).netloc
+
+        frontier = deque([(root, 0)])
+        seen = {root}
+        in_flight = {}
+        futures = {}
+        submitted = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            while frontier or futures:
+                # Hosts at their cap are passed over, not waited on, so one slow host can't stall the crawl
+                deferred = []
+                while frontier and len(futures) < self.max_concurrency and submitted < prompt["max_pages"]:
+                    url, depth = frontier.popleft()
+                    host = urlsplit(url).netloc
+                    if in_flight.get(host, 0) >= self.per_host_concurrency:
+                        deferred.append((url, depth))
+                        continue
+                    in_flight[host] = in_flight.get(host, 0) + 1
+                    submitted += 1
+                    # Each fetch runs in a copy of this context so it reports to the crawl's measurement
+                    futures[pool.submit(contextvars.copy_context().run, self._fetch_page, url, prompt["max_page_bytes"])] = (url, depth, host)
+                frontier.extendleft(reversed(deferred))
+                if submitted >= prompt["max_pages"]:
+                    frontier.clear()
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth, host = futures.pop(future)
+                    in_flight[host] -= 1
+                    try:
+                        skip_reason, final_url, status_code, content_type, content = future.result()
+                        if skip_reason is not None:
+                            self.logger.debug("Skipping %s: %s", url, skip_reason)
+                            stats["skipped"][skip_reason] += 1
+                            continue
+                        # A redirect lands on a URL of its own, which may already have been crawled or queued
+                        final_url = self.normalize_url(final_url) or url
+                        if final_url != url:
+                            if final_url in seen:
+                                self.logger.debug("Skipping %s: redirected to already seen %s", url, final_url)
+                                continue
+                            seen.add(final_url)
+                            url = final_url
+                        title, paragraphs, links = parse_page(content, self.parser)
+                    except Exception as e:
+                        self.logger.warning("Failed to crawl %s: %s", url, e)
+                        stats["errors"].append({"url": url, "error": str(e)})
+                        continue
+
+                    if depth < prompt["max_depth"]:
+                        for href in links:
+                            link = self.normalize_url(urljoin(url, href))
+                            if link is None or link in seen:
+                                continue
+                            if prompt["same_host"] and urlsplit(link).netloc != root_host:
+                                continue
+                            seen.add(link)
+                            frontier.append((link, depth + 1))
+
+                    yield {"url": url, "depth": depth, "title": title, "paragraphs": paragraphs}
+
+    def _crawl_result(self, prompt: dict, pages: list, stats: dict):
+        if not pages:
+            raise RuntimeError(f"Failed to crawl {prompt['url']}: {stats['errors'] or stats['skipped']}")
+
+        data = {
+            "pages": pages
+        }
+
+        metadata = {
+            "url": prompt["url"],
+            "pages": len(pages),
+            "max_depth": prompt["max_depth"],
+            "skipped": stats["skipped"],
+            "errors": stats["errors"]
+        }
+
+        self.logger.info("Crawled %s pages from %s", len(pages), prompt['url'])
+        return data, metadata
+
+    def generate_data(self, prompt: dict, payload_data):
+        stats = {}
+        pages = list(self.crawl(prompt, stats))
+        return self._crawl_result(prompt, pages, stats)
+
+    async def agenerate_data(self, prompt: dict, payload_data):
+        return await asyncio.to_thread(self.generate_data, prompt, payload_data)
+
+    def stream(self):
+        """
+        Construct the artifact while yielding each page as it arrives. Cached pages are yielded from memory.
+        """
+        return artifact_metrics.measure_iter(self, "construct", self._stream())
+
+    def _stream(self):
+        cache_key = self._load_cached()
+        if self.data is None:
+            stats = {}
+            pages = []
+            for page in artifact_metrics.measure_iter(self, "generate", self.crawl(self.prompt, stats)):
+                pages.append(page)
+                yield page
+            self.data, self.metadata = self._crawl_result(self.prompt, pages, stats)
+        else:
+            yield from self.data["pages"]
+        self._complete_construct(cache_key)
+
+class StabilityArtifact(Artifact, GraphicalMixin):
+    __slots__ = ()
+    provider = "stability"
+
     @classmethod
     def build(cls, prompt: str, position_x: int, position_y: int, resolution_x: int, resolution_y: int, **kwargs):
-        logger = setup_logger(cls.__name__)
-        logger.debug(f"Building {cls.__name__} with prompt: {prompt[:50]}, position: ({position_x}, {position_y}), resolution: {resolution_x}x{resolution_y}")
+        cls.logger.debug("Building %s with prompt: %.50s, position: (%s, %s), resolution: %sx%s", cls.__name__, prompt, position_x, position_y, resolution_x, resolution_y)
         
         prompt_dict = {
             "prompt": prompt,
@@ -74,9 +362,8 @@ class StabilityArtifact(Artifact, GraphicalMixin):
         
         return cls(prompt_dict, mandatory_tags=mandatory_tags, **kwargs)
 
-    def generate_image(self, prompt: str):
-        self.logger.info(f"Generating image with prompt: {prompt[:50]}...")
-        api_url = "https://api.stability.ai/v2beta/stable-image/generate/core"
+    def _image_request(self, prompt: str):
+        api_url = provider_url(self.provider, "/v2beta/stable-image/generate/core")
         api_key = os.getenv("STABILITY_API_KEY")
         
         if api_key is None:
@@ -92,26 +379,55 @@ class StabilityArtifact(Artifact, GraphicalMixin):
             "output_format": "png"
         }
         files = {"none": ''}
+        return api_url, headers, data, files
+
+    def _image_response(self, status_code: int, content: bytes, json_body):
+        if status_code == 200:
+            self.logger.info("Image generated successfully")
+            return content
+        else:
+            self.logger.error("API request failed with status code: %s", status_code)
+            raise Exception(str(json_body()))
+
+    def generate_image(self, prompt: str):
+        self.logger.info("Generating image with prompt: %.50s...", prompt)
+        api_url, headers, data, files = self._image_request(prompt)
         
         try:
             self.logger.debug("Sending request to Stability API")
-            response = requests.post(api_url, headers=headers, files=files, data=data)
-            
-            if response.status_code == 200:
-                self.logger.info("Image generated successfully")
-                image_data = response.content
-                return image_data
-            else:
-                self.logger.error(f"API request failed with status code: {response.status_code}")
-                raise Exception(str(response.json()))
+
+            def post():
+                response = get_session(self.provider).post(api_url, headers=headers, files=files, data=data)
+                self.retry_policy.check_response(response.status_code, response.headers)
+                return response
+
+            response = self._call_provider(post)
+            artifact_metrics.record(bytes_in=len(response.content), bytes_out=len(prompt.encode('utf-8')))
+            return self._image_response(response.status_code, response.content, response.json)
         except Exception as e:
-            self.logger.error(f"Error in Stability API call: {str(e)}")
+            self.logger.error("Error in Stability API call: %s", e)
             raise
 
-    def generate_data(self, prompt: dict, payload_data):
-        self.logger.info("Generating data for Stability artifact")
-        image_data = self.generate_image(prompt["prompt"])
+    async def agenerate_image(self, prompt: str):
+        self.logger.info("Generating image asynchronously with prompt: %.50s...", prompt)
+        api_url, headers, data, files = self._image_request(prompt)
         
+        try:
+            self.logger.debug("Sending async request to Stability API")
+
+            async def post():
+                response = await get_async_client(self.provider).post(api_url, headers=headers, files=files, data=data)
+                self.retry_policy.check_response(response.status_code, response.headers)
+                return response
+
+            response = await self._acall_provider(post)
+            artifact_metrics.record(bytes_in=len(response.content), bytes_out=len(prompt.encode('utf-8')))
+            return self._image_response(response.status_code, response.content, response.json)
+        except Exception as e:
+            self.logger.error("Error in Stability API call: %s", e)
+            raise
+
+    def _image_result(self, prompt: dict, image_data: bytes):
         data = {
             "image": image_data
         }
@@ -125,10 +441,18 @@ class StabilityArtifact(Artifact, GraphicalMixin):
         
         return data, metadata
 
+    def generate_data(self, prompt: dict, payload_data):
+        self.logger.info("Generating data for Stability artifact")
+        return self._image_result(prompt, self.generate_image(prompt["prompt"]))
+
+    async def agenerate_data(self, prompt: dict, payload_data):
+        self.logger.info("Generating data for Stability artifact")
+        return self._image_result(prompt, await self.agenerate_image(prompt["prompt"]))
+
     def validate_data(self, data: dict):
         self.logger.debug("Validating Stability artifact data")
         super().validate_data(data)
-        if not isinstance(data.get("image"), bytes):
+        if not is_binary(data.get("image")):
             self.logger.error("Validation failed: Image data is not in bytes format")
             raise ValueError("Image data must be in bytes format")
         self.logger.info("Stability artifact data validated successfully")
@@ -142,33 +466,38 @@ class StabilityArtifact(Artifact, GraphicalMixin):
         if not self.constructed:
             raise ValueError("StabilityArtifact must be constructed before outputting data.")
 
-        if 'image' not in self.data or not isinstance(self.data['image'], bytes):
+        if 'image' not in self.data or not is_binary(self.data['image']):
             raise ValueError("StabilityArtifact does not contain valid image data.")
 
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
 
         with open(filepath, 'wb') as f:
-            f.write(self.data['image'])
+            for chunk in iter_binary(self.data['image']):
+                f.write(chunk)
 
         # Write metadata to a separate JSON file
         metadata_filepath = os.path.splitext(filepath)[0] + '_metadata.json'
         with open(metadata_filepath, 'w', encoding='utf-8') as f:
             json.dump(self.metadata, f, indent=2)
 
-        self.logger.info(f"Image data output to file: {filepath}")
-        self.logger.info(f"Metadata output to file: {metadata_filepath}")
+        self.logger.info("Image data output to file: %s", filepath)
+        self.logger.info("Metadata output to file: %s", metadata_filepath)
         
 class MediaStabilityArtifact(MediaMixin, StabilityArtifact):
-    pass
+    __slots__ = ()
 class NarrationArtifact(Artifact):
-    def __init__(self, *args, **kwargs):
-        self.logger = setup_logger(self.__class__.__name__)
+    __slots__ = ('spool_path',)
+    provider = "elevenlabs"
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, *args, spool_path: str = None, **kwargs):
+        # When set, audio is written to this file as it downloads instead of being buffered in memory first
+        self.spool_path = spool_path
         super().__init__(*args, **kwargs)
 
     @classmethod
     def build(cls, prompt: str, **kwargs):
-        logger = setup_logger(cls.__name__)
-        logger.debug(f"Building {cls.__name__} with prompt: {prompt[:50]}...")
+        cls.logger.debug("Building %s with prompt: %.50s...", cls.__name__, prompt)
         
         prompt_dict = {
             "prompt": prompt
@@ -176,14 +505,16 @@ class NarrationArtifact(Artifact):
         
         return cls(prompt_dict, **kwargs)
 
-    def generate_data(self, prompt: dict, payload_data):
-        self.logger.info(f"Generating audio data for prompt: {prompt['prompt'][:50]}...")
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/29vD33N1CtxCmqQRPOHJ"
+    def _speech_request(self, prompt: dict):
+        url = provider_url(self.provider, "/v1/text-to-speech/29vD33N1CtxCmqQRPOHJ")
         headers = {
             "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": os.getenv("ELEVEN_API_KEY")
+            "Content-Type": "application/json"
         }
+        # requests silently dropped a missing key, httpx refuses None header values
+        api_key = os.getenv("ELEVEN_API_KEY")
+        if api_key is not None:
+            headers["xi-api-key"] = api_key
         data = {
             "text": prompt['prompt'],
             "model_id": "eleven_monolingual_v1",
@@ -192,25 +523,88 @@ class NarrationArtifact(Artifact):
                 "similarity_boost": 0.5
             }
         }
-        CHUNK_SIZE = 1024 
-        response = requests.post(url, json=data, headers=headers)
+        return url, headers, data
 
-        if response.status_code != 200:
-            response_content = json.loads(response.content)
-            self.logger.error(f"API request failed. Status code: {response.status_code}. Detail: {response_content.get('detail')}")
-            raise ValueError(f"Request failed with status code {response.status_code}")
-    
-        audio_data = b''
-        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-            if chunk:
-                audio_data += chunk
-        
+    def _check_speech_response(self, status_code: int, read_content):
+        if status_code != 200:
+            response_content = json.loads(read_content())
+            self.logger.error("API request failed. Status code: %s. Detail: %s", status_code, response_content.get('detail'))
+            raise ValueError(f"Request failed with status code {status_code}")
+
+    def _speech_chunks(self, prompt: dict, chunk_size: int):
+        url, headers, data = self._speech_request(prompt)
+        artifact_metrics.record(bytes_out=len(json.dumps(data)))
+
+        # Only opening the stream is retried, a response that fails halfway through is not replayed
+        def open_stream():
+            response = get_session(self.provider).post(url, json=data, headers=headers, stream=True)
+            try:
+                self.retry_policy.check_response(response.status_code, response.headers)
+            except RetryableError:
+                response.close()
+                raise
+            return response
+
+        with self._call_provider(open_stream) as response:
+            self._check_speech_response(response.status_code, lambda: response.content)
+            for chunk in artifact_metrics.timed_iter(response.iter_content(chunk_size=chunk_size)):
+                if chunk:
+                    yield chunk
+
+    async def _aspeech_chunks(self, prompt: dict, chunk_size: int):
+        url, headers, data = self._speech_request(prompt)
+        artifact_metrics.record(bytes_out=len(json.dumps(data)))
+        client = get_async_client(self.provider)
+
+        async def open_stream():
+            response = await client.send(client.build_request("POST", url, json=data, headers=headers), stream=True)
+            try:
+                self.retry_policy.check_response(response.status_code, response.headers)
+            except RetryableError:
+                await response.aclose()
+                raise
+            return response
+
+        response = await self._acall_provider(open_stream)
+        try:
+            if response.status_code != 200:
+                await response.aread()
+            self._check_speech_response(response.status_code, lambda: response.content)
+            async for chunk in artifact_metrics.atimed_iter(response.aiter_bytes(chunk_size)):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    @staticmethod
+    def _spooled_to(data: dict, filepath: str) -> bool:
+        audio = data.get("audio") if data else None
+        return isinstance(audio, Blob) and audio.offset == 0 and os.path.realpath(audio.path) == os.path.realpath(filepath)
+
+    def _shared_result(self, result):
+        # The spool file belongs to the caller, who may move or overwrite it, so the cache and any
+        # coalesced waiters get the bytes instead
+        data, metadata = result
+        if self.spool_path is not None and self._spooled_to(data, self.spool_path):
+            return dict(data, audio=data["audio"].read()), metadata
+        return result
+
+    def _open_audio_buffer(self):
+        if self.spool_path is None:
+            return io.BytesIO()
+        os.makedirs(os.path.dirname(self.spool_path) or '.', exist_ok=True)
+        return open(self.spool_path, 'w+b')
+
+    def _finish_audio(self, prompt: dict, buffer):
         try:
-            duration = self.get_audio_duration(audio_data)
-            self.logger.info(f"Audio generated successfully. Duration: {duration} seconds")
+            buffer.seek(0)
+            duration = self.get_audio_duration(buffer)
+            self.logger.info("Audio generated successfully. Duration: %s seconds", duration)
         except Exception as e:
-            self.logger.error(f"Error getting audio duration: {str(e)}")
+            self.logger.error("Error getting audio duration: %s", e)
             raise ValueError("Likely invalid audio data, could be network issue?")
+
+        # Spooled audio stays on disk behind a lazy handle
+        audio_data = buffer.getvalue() if isinstance(buffer, io.BytesIO) else Blob(self.spool_path)
         
         data = {
             "audio": audio_data
@@ -223,37 +617,142 @@ class NarrationArtifact(Artifact):
         
         return data, metadata
 
+    def generate_data(self, prompt: dict, payload_data):
+        self.logger.info("Generating audio data for prompt: %.50s...", prompt['prompt'])
+        with self._open_audio_buffer() as buffer:
+            for chunk in self._speech_chunks(prompt, self.CHUNK_SIZE):
+                buffer.write(chunk)
+            return self._finish_audio(prompt, buffer)
+
+    async def agenerate_data(self, prompt: dict, payload_data):
+        self.logger.info("Generating audio data asynchronously for prompt: %.50s...", prompt['prompt'])
+        with self._open_audio_buffer() as buffer:
+            async for chunk in self._aspeech_chunks(prompt, self.CHUNK_SIZE):
+                buffer.write(chunk)
+            return self._finish_audio(prompt, buffer)
+
+    def stream(self, chunk_size: int = None):
+        """
+        Construct the artifact while yielding audio chunks as they arrive, so downstream consumers
+        can start before the narration has finished downloading. Cached audio is yielded from memory.
+        """
+        return artifact_metrics.measure_iter(self, "construct", self._stream(chunk_size or self.CHUNK_SIZE))
+
+    def _stream(self, chunk_size: int):
+        cache_key = self._load_cached()
+        if self.data is None:
+            with self._open_audio_buffer() as buffer:
+                for chunk in artifact_metrics.measure_iter(self, "generate", self._speech_chunks(self.prompt, chunk_size)):
+                    buffer.write(chunk)
+                    yield chunk
+                self.data, self.metadata = self._finish_audio(self.prompt, buffer)
+        else:
+            yield from self.iter_audio(chunk_size)
+        self._complete_construct(cache_key)
+
+    def astream(self, chunk_size: int = None):
+        return artifact_metrics.ameasure_iter(self, "construct", self._astream(chunk_size or self.CHUNK_SIZE))
+
+    async def _astream(self, chunk_size: int):
+        cache_key = self._load_cached()
+        if self.data is None:
+            with self._open_audio_buffer() as buffer:
+                async for chunk in artifact_metrics.ameasure_iter(self, "generate", self._aspeech_chunks(self.prompt, chunk_size)):
+                    buffer.write(chunk)
+                    yield chunk
+                self.data, self.metadata = self._finish_audio(self.prompt, buffer)
+        else:
+            for chunk in self.iter_audio(chunk_size):
+                yield chunk
+        self._complete_construct(cache_key)
+
+    def iter_audio(self, chunk_size: int = None):
+        """
+        Iterate over the generated audio in chunks without copying the whole buffer.
+        """
+        yield from iter_binary(self.data["audio"], chunk_size or self.CHUNK_SIZE)
+
     def get_audio_duration(self, audio_data):
         self.logger.debug("Getting audio duration")
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-            temp_file.write(audio_data)
-            temp_file_path = temp_file.name
-
-        audio = MP3(temp_file_path)
+        # mutagen reads file objects directly, so there is no need to round-trip through a temp file
+        fileobj = io.BytesIO(audio_data) if isinstance(audio_data, (bytes, bytearray, memoryview)) else audio_data
+        audio = MP3(fileobj)
         duration = audio.info.length
-        os.remove(temp_file_path)
-        self.logger.debug(f"Audio duration: {duration} seconds")
+        self.logger.debug("Audio duration: %s seconds", duration)
         return duration
 
     def validate_data(self, data: dict):
         self.logger.debug("Validating Narration artifact data")
         super().validate_data(data)
-        if not isinstance(data.get("audio"), bytes):
+        if not is_binary(data.get("audio")):
             self.logger.error("Validation failed: Audio data is not in bytes format")
             raise ValueError("Audio data must be in bytes format")
         self.logger.info("Narration artifact data validated successfully")
+
+    def output_data_to_file(self, filepath: str):
+        """
+        Output the NarrationArtifact's audio data to a file.
+        
+        :param filepath: The path where the audio file should be saved.
+        """
+        if not self.constructed:
+            raise ValueError("NarrationArtifact must be constructed before outputting data.")
+
+        if 'audio' not in self.data or not is_binary(self.data['audio']):
+            raise ValueError("NarrationArtifact does not contain valid audio data.")
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        # Audio spooled by this artifact may already be on disk at its destination, a cached or shared
+        # result never is
+        if not self._spooled_to(self.data, filepath):
+            with open(filepath, 'wb') as f:
+                for chunk in self.iter_audio():
+                    f.write(chunk)
+
+        metadata_filepath = os.path.splitext(filepath)[0] + '_metadata.json'
+        with open(metadata_filepath, 'w', encoding='utf-8') as f:
+            json.dump(self.metadata, f, indent=2)
+
+        self.logger.info("Audio data output to file: %s", filepath)
+        self.logger.info("Metadata output to file: %s", metadata_filepath)
         
 class MediaNarrationArtifact(MediaMixin, NarrationArtifact):
-    pass
+    __slots__ = ()
+# A sentence ends at terminal punctuation followed by whitespace, or at a blank line
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n{2,}')
+
+def _split_sentences(buffer: str):
+    parts = SENTENCE_BOUNDARY.split(buffer)
+    return [part.strip() for part in parts[:-1] if part.strip()], parts[-1]
+
+def iter_sentences(deltas):
+    """
+    Regroup streamed text deltas into whole sentences, each yielded as soon as the text after it begins.
+    """
+    buffer = ''
+    for delta in deltas:
+        sentences, buffer = _split_sentences(buffer + delta)
+        yield from sentences
+    if buffer.strip():
+        yield buffer.strip()
+
+async def aiter_sentences(deltas):
+    buffer = ''
+    async for delta in deltas:
+        sentences, buffer = _split_sentences(buffer + delta)
+        for sentence in sentences:
+            yield sentence
+    if buffer.strip():
+        yield buffer.strip()
+
 class ClaudeArtifact(Artifact):
-    def __init__(self, *args, **kwargs):
-        self.logger = setup_logger(self.__class__.__name__)
-        super().__init__(*args, **kwargs)
+    __slots__ = ()
+    provider = "anthropic"
 
     @classmethod
     def build(cls, prompt: str, content: str, model: str = "claude-3-sonnet-20240229", max_response_length: int = 4096, **kwargs):
-        logger = setup_logger(cls.__name__)
-        logger.debug(f"Building {cls.__name__} with prompt: {prompt[:50]}, content: {content[:50]}, model: {model}")
+        cls.logger.debug("Building %s with prompt: %.50s, content: %.50s, model: %s", cls.__name__, prompt, content, model)
         
         prompt_dict = {
             "prompt": prompt,
@@ -264,49 +763,198 @@ class ClaudeArtifact(Artifact):
         
         return cls(prompt_dict, **kwargs)
     
-    def generate_data(self, prompt: dict, payload_data):
-        self.logger.info("Generating data with Claude API")
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        client = anthropic.Client(api_key=api_key)
-        
-        prompt_prompt = prompt["prompt_prompt"]
-        prompt_content = prompt["prompt_content"]
-        prompt_model = prompt["prompt_model"]
-        max_response_length = prompt["max_response_length"]
+    def _message_params(self, prompt: dict):
+        full_prompt = f"{prompt['prompt']} {prompt['content']}"
+        self.logger.debug("Full prompt: %s...", full_prompt[:100])
+        return {
+            "model": prompt["model"],
+            "max_tokens": prompt["max_response_length"],
+            "messages": [
+                {"role": "user", "content": full_prompt}
+            ]
+        }
 
-        full_prompt = f"{prompt_prompt} {prompt_content}"
-        self.logger.debug(f"Full prompt: {full_prompt[:100]}...")
-        
-        try:
-            self.logger.debug(f"Sending request to Claude API with model: {prompt_model}, max_tokens: {max_response_length}")
-            response = client.messages.create(
-                model=prompt_model,
-                max_tokens=max_response_length,
-                messages=[
-                    {"role": "user", "content": full_prompt}
-                ]
-            )
-            self.logger.info("Successfully received response from Claude API")
-        except Exception as e:
-            self.logger.error(f"Error in Claude API call: {str(e)}")
-            raise ValueError("Check Model and API Key!")
+    def _estimated_tokens(self, params: dict) -> tuple:
+        # (input, output): a rough four characters per token for the prompt and the full output allowance,
+        # settled against the response's usage once it arrives
+        return len(params["messages"][0]["content"]) // 4, params["max_tokens"]
+
+    @staticmethod
+    def _used_tokens(usage) -> tuple:
+        return usage.input_tokens, usage.output_tokens
+
+    def _raise_retryable(self, e: Exception):
+        if isinstance(e, anthropic.APIStatusError):
+            self.retry_policy.check_response(e.status_code, e.response.headers)
+        elif isinstance(e, anthropic.APIConnectionError):
+            raise RetryableError(str(e))
 
-        response_text = response.content[0].text
-        self.logger.debug(f"Response text (first 100 chars): {response_text[:100]}...")
-        self.logger.debug(f"Response type: {type(response_text)}")
+    def _response_result(self, prompt: dict, response_text: str):
+        self.logger.debug("Response text (first 100 chars): %s...", response_text[:100])
+        self.logger.debug("Response type: %s", type(response_text))
 
         data = {
             "response": response_text
         }
         
         metadata = {
-            "model": prompt_model,
-            "max_response_length": max_response_length,
+            "model": prompt["model"],
+            "max_response_length": prompt["max_response_length"],
             "actual_response_length": len(response_text)
         }
         
         return data, metadata
 
+    def generate_data(self, prompt: dict, payload_data):
+        self.logger.info("Generating data with Claude API")
+        client = get_anthropic_client(self.provider)
+        params = self._message_params(prompt)
+        
+        try:
+            self.logger.debug("Sending request to Claude API with model: %s, max_tokens: %s", params['model'], params['max_tokens'])
+
+            def create():
+                try:
+                    return client.messages.create(**params)
+                except anthropic.APIError as e:
+                    self._raise_retryable(e)
+                    raise
+
+            response = self._call_provider(create, tokens=self._estimated_tokens(params), usage=lambda response: self._used_tokens(response.usage))
+            self.logger.info("Successfully received response from Claude API")
+            artifact_metrics.record(bytes_out=len(json.dumps(params)), bytes_in=len(response.content[0].text.encode('utf-8')))
+        except Exception as e:
+            self.logger.error("Error in Claude API call: %s", e)
+            raise ValueError("Check Model and API Key!") from e
+
+        return self._response_result(prompt, response.content[0].text)
+
+    async def agenerate_data(self, prompt: dict, payload_data):
+        self.logger.info("Generating data with async Claude API")
+        client = get_async_anthropic_client(self.provider)
+        params = self._message_params(prompt)
+        
+        try:
+            self.logger.debug("Sending async request to Claude API with model: %s, max_tokens: %s", params['model'], params['max_tokens'])
+
+            async def create():
+                try:
+                    return await client.messages.create(**params)
+                except anthropic.APIError as e:
+                    self._raise_retryable(e)
+                    raise
+
+            response = await self._acall_provider(create, tokens=self._estimated_tokens(params), usage=lambda response: self._used_tokens(response.usage))
+            self.logger.info("Successfully received response from Claude API")
+            artifact_metrics.record(bytes_out=len(json.dumps(params)), bytes_in=len(response.content[0].text.encode('utf-8')))
+        except Exception as e:
+            self.logger.error("Error in Claude API call: %s", e)
+            raise ValueError("Check Model and API Key!") from e
+
+        return self._response_result(prompt, response.content[0].text)
+
+    def _text_deltas(self, prompt: dict):
+        client = get_anthropic_client(self.provider)
+        params = self._message_params(prompt)
+        artifact_metrics.record(bytes_out=len(json.dumps(params)))
+
+        # Only opening the stream is retried, a response that fails halfway through is not replayed
+        def open_stream():
+            manager = client.messages.stream(**params)
+            try:
+                return manager, manager.__enter__()
+            except anthropic.APIError as e:
+                self._raise_retryable(e)
+                raise
+
+        try:
+            self.logger.debug("Opening stream to Claude API with model: %s, max_tokens: %s", params['model'], params['max_tokens'])
+            tokens = self._estimated_tokens(params)
+            manager, stream = self._call_provider(open_stream, tokens=tokens)
+        except Exception as e:
+            self.logger.error("Error in Claude API call: %s", e)
+            raise ValueError("Check Model and API Key!") from e
+
+        try:
+            yield from artifact_metrics.timed_iter(stream.text_stream)
+            # Usage is only final once the last event has arrived
+            self._settle_tokens(tokens, self._used_tokens(stream.current_message_snapshot.usage))
+        finally:
+            manager.__exit__(None, None, None)
+
+    async def _atext_deltas(self, prompt: dict):
+        client = get_async_anthropic_client(self.provider)
+        params = self._message_params(prompt)
+        artifact_metrics.record(bytes_out=len(json.dumps(params)))
+
+        async def open_stream():
+            manager = client.messages.stream(**params)
+            try:
+                return manager, await manager.__aenter__()
+            except anthropic.APIError as e:
+                self._raise_retryable(e)
+                raise
+
+        try:
+            self.logger.debug("Opening async stream to Claude API with model: %s, max_tokens: %s", params['model'], params['max_tokens'])
+            tokens = self._estimated_tokens(params)
+            manager, stream = await self._acall_provider(open_stream, tokens=tokens)
+        except Exception as e:
+            self.logger.error("Error in Claude API call: %s", e)
+            raise ValueError("Check Model and API Key!") from e
+
+        try:
+            async for delta in artifact_metrics.atimed_iter(stream.text_stream):
+                yield delta
+            self._settle_tokens(tokens, self._used_tokens(stream.current_message_snapshot.usage))
+        finally:
+            await manager.__aexit__(None, None, None)
+
+    def stream(self):
+        """
+        Construct the artifact while yielding the response text as it is generated, so downstream
+        steps can start before the last token arrives. A cached response is yielded as one delta.
+        """
+        return artifact_metrics.measure_iter(self, "construct", self._stream())
+
+    def _stream(self):
+        cache_key = self._load_cached()
+        if self.data is None:
+            parts = []
+            for delta in artifact_metrics.measure_iter(self, "generate", self._text_deltas(self.prompt)):
+                parts.append(delta)
+                yield delta
+            self.logger.info("Finished streaming response from Claude API")
+            self.data, self.metadata = self._response_result(self.prompt, "".join(parts))
+        else:
+            yield self.data["response"]
+        self._complete_construct(cache_key)
+
+    def astream(self):
+        return artifact_metrics.ameasure_iter(self, "construct", self._astream())
+
+    async def _astream(self):
+        cache_key = self._load_cached()
+        if self.data is None:
+            parts = []
+            async for delta in artifact_metrics.ameasure_iter(self, "generate", self._atext_deltas(self.prompt)):
+                parts.append(delta)
+                yield delta
+            self.logger.info("Finished streaming response from Claude API")
+            self.data, self.metadata = self._response_result(self.prompt, "".join(parts))
+        else:
+            yield self.data["response"]
+        self._complete_construct(cache_key)
+
+    def stream_sentences(self):
+        """
+        Like stream, but yields whole sentences, e.g. to hand each one to a NarrationArtifact.
+        """
+        return iter_sentences(self.stream())
+
+    def astream_sentences(self):
+        return aiter_sentences(self.astream())
+
     def validate_data(self, data: dict):
         self.logger.debug("Validating Claude response data")
         super().validate_data(data)
@@ -314,21 +962,6 @@ class ClaudeArtifact(Artifact):
             self.logger.error("Validation failed: Response data is not a string")
             raise ValueError("Response data must be a string")
         if len(data["response"]) > self.prompt["max_response_length"]:
-            self.logger.error(f"Validation failed: Response length ({len(data['response'])}) exceeds the specified limit of max tokens ({self.prompt['max_response_length']})")
+            self.logger.error("Validation failed: Response length (%s) exceeds the specified limit of max tokens (%s)", len(data['response']), self.prompt['max_response_length'])
             raise ValueError(f"Response length exceeds the specified limit of max tokens")
         self.logger.info("Claude response data validated successfully")
-    @classmethod
-    def build(cls, prompt: str, start_time: float, end_time: float, **kwargs):
-        logger = setup_logger(cls.__name__)
-        logger.debug(f"Building {cls.__name__} with prompt: {prompt[:50]}, start_time: {start_time}, end_time: {end_time}")
-        
-        prompt_dict = {
-            "prompt": prompt
-        }
-        
-        mandatory_tags = {
-            "start_time": start_time,
-            "end_time": end_time
-        }
-        
-        return cls(prompt_dict, mandatory_tags=mandatory_tags, **kwargs)
\ No newline at end of file
@@ -0,0 +1,287 @@
+"""
+Benchmarks for artifact instantiation, construction and file output, run against local stand-in
+servers for every provider so that results only depend on this code and the configured conditions.
+
+    python bench.py --artifacts 200 --latency 0.05 --error-rate 0.01 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import artifact_http
+from artifact_executor import construct_many, construct_one
+from artifacts import WebScraperArtifact, CrawlerArtifact, StabilityArtifact, NarrationArtifact, ClaudeArtifact
+
+# One 128 kbps, 44.1 kHz MPEG-1 Layer III frame, enough for mutagen to read a duration
+MP3_FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+class StandInServer:
+    """
+    Answers like the scraper targets, Stability, ElevenLabs and Claude endpoints, all on one local port.
+    Every response is delayed by latency seconds and a fraction error_rate of them are a retryable 503.
+    """
+    def __init__(self, latency: float = 0.0, payload_size: int = 64 * 1024, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.payload_size = payload_size
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._bodies = self._build_bodies()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes, with Nagle on every keep-alive response would wait
+            # out a delayed ACK and the numbers would measure that instead of this code
+            disable_nagle_algorithm = True
+
+            def _respond(self, status: int, body: bytes, content_type: str, headers: dict = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                time.sleep(server.latency)
+                if server._should_fail():
+                    self._respond(503, b'{"detail": "stand-in error"}', 'application/json', {'Retry-After': '0'})
+                    return
+                self._respond(*server._route(self.command, self.path))
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._handle()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._original_urls = {}
+
+    def _build_bodies(self) -> dict:
+        paragraphs = "".join(f"<p>Paragraph {i} of the stand-in page with some filler text to parse.</p>" for i in range(max(1, self.payload_size // 80)))
+        message = {
+            "id": "msg_standin",
+            "type": "message",
+            "role": "assistant",
+            "model": "claude-3-sonnet-20240229",
+            "content": [{"type": "text", "text": "x" * self.payload_size}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 10, "output_tokens": self.payload_size // 4}
+        }
+        return {
+            "paragraphs": paragraphs,
+            "image": PNG_HEADER + bytes(max(0, self.payload_size - len(PNG_HEADER))),
+            "audio": MP3_FRAME * max(1, self.payload_size // len(MP3_FRAME)),
+            "message": json.dumps(message).encode('utf-8')
+        }
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+    def _route(self, method: str, path: str):
+        if method == "POST" and path.startswith("/v2beta/stable-image/"):
+            return 200, self._bodies["image"], 'image/png'
+        if method == "POST" and path.startswith("/v1/text-to-speech/"):
+            return 200, self._bodies["audio"], 'audio/mpeg'
+        if method == "POST" and path.startswith("/v1/messages"):
+            return 200, self._bodies["message"], 'application/json'
+        if path == "/robots.txt":
+            return 404, b'', 'text/plain'
+        # Pages link onward to a few siblings so crawls have a frontier to work through
+        page = int(path.rsplit('/', 1)[-1]) if path.rsplit('/', 1)[-1].isdigit() else 0
+        base = path.rsplit('/', 1)[0]
+        links = "".join(f'<a href="{base}/{page + step}">next</a>' for step in range(1, 4))
+        body = f"<html><head><title>Page {page}</title></head><body>{links}{self._bodies['paragraphs']}</body></html>"
+        return 200, body.encode('utf-8'), 'text/html; charset=utf-8'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        for provider in ("stability", "elevenlabs", "anthropic"):
+            self._original_urls[provider] = artifact_http.get_config(provider).base_url
+            artifact_http.configure(provider, base_url=self.url)
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        for provider, url in self._original_urls.items():
+            artifact_http.configure(provider, base_url=url)
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def bench_instantiation(factory, n: int) -> dict:
+    start = time.perf_counter()
+    for i in range(n):
+        factory(i)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [factory(i) for i in range(1000)]
+    per_instance = (tracemalloc.get_traced_memory()[0] - before) / len(kept)
+    tracemalloc.stop()
+
+    return {"instances_per_second": n / elapsed, "bytes_per_instance": per_instance}
+
+
+def bench_construct(factory, extension: str, n: int, concurrency: int, output_dir: str, memory_samples: int = 20) -> dict:
+    """
+    Construct n artifacts concurrently, then measure memory per constructed artifact on a small
+    sequential sample, then write every constructed artifact to output_dir.
+    """
+    artifacts = [factory(i) for i in range(n)]
+    limits = {provider: concurrency for provider in ("web", "stability", "elevenlabs", "anthropic")}
+    start = time.perf_counter()
+    results = construct_many(artifacts, max_concurrency=concurrency, provider_limits=limits)
+    wall = time.perf_counter() - start
+    latencies = [result.elapsed for result in results if result.ok]
+    constructed = [result.artifact for result in results if result.ok]
+
+    # Samples that run out of retries are counted rather than ending the run, their memory still counts
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sample = [factory(n + i) for i in range(memory_samples)]
+    sample_failures = sum(not construct_one(artifact).ok for artifact in sample)
+    memory = (tracemalloc.get_traced_memory()[0] - before) / len(sample) if sample else None
+    tracemalloc.stop()
+
+    written = 0
+    start = time.perf_counter()
+    for index, artifact in enumerate(constructed):
+        filepath = os.path.join(output_dir, f"{index}{extension}")
+        artifact.output_data_to_file(filepath)
+        metadata_filepath = os.path.join(output_dir, f"{index}_metadata.json")
+        written += os.path.getsize(filepath) + (os.path.getsize(metadata_filepath) if os.path.exists(metadata_filepath) else 0)
+    output_time = time.perf_counter() - start
+
+    return {
+        "artifacts": n,
+        "failed": n - len(constructed),
+        "sample_failures": sample_failures,
+        "wall_time": wall,
+        "artifacts_per_second": len(constructed) / wall if wall else None,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p99": percentile(latencies, 0.99),
+        "bytes_per_artifact": memory,
+        "files_per_second": len(constructed) / output_time if constructed and output_time else None,
+        "output_bytes_per_second": written / output_time if constructed and output_time else None
+    }
+
+
+INSTANTIATION = {
+    "ClaudeArtifact.build": lambda i: ClaudeArtifact.build("Summarize", f"document {i}"),
+    "WebScraperArtifact.build": lambda i: WebScraperArtifact.build(f"https://example.com/{i}"),
+    "WebScraperArtifact(tags)": lambda i: WebScraperArtifact({"url": f"https://example.com/{i}"}, mandatory_tags={"index": i}, optional_tags={"section": "docs"})
+}
+
+
+def construct_benchmarks(url: str, payload_size: int) -> dict:
+    """
+    name -> (factory, file extension). Every prompt is unique so no construction is coalesced or cached.
+    """
+    return {
+        "WebScraperArtifact": (lambda i: WebScraperArtifact.build(f"{url}/page/{i}"), ".json"),
+        "CrawlerArtifact": (lambda i: CrawlerArtifact.build(f"{url}/site/{i}/0", max_depth=2, max_pages=10, max_page_bytes=max(2 * payload_size, CrawlerArtifact.MAX_PAGE_BYTES)), ".json"),
+        "StabilityArtifact": (lambda i: StabilityArtifact.build(f"benchmark image {i}", 0, 0, 512, 512), ".png"),
+        "NarrationArtifact": (lambda i: NarrationArtifact.build(f"benchmark narration {i}"), ".mp3"),
+        "ClaudeArtifact": (lambda i: ClaudeArtifact.build("Summarize", f"document {i}", max_response_length=payload_size), ".json")
+    }
+
+
+def format_value(value, scale: float = 1.0, spec: str = ",.1f", width: int = 7) -> str:
+    # Percentiles and rates are None when every construction failed
+    return f"{'-':>{width}}" if value is None else f"{value * scale:>{width}{spec}}"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="Instances to create per instantiation benchmark")
+    parser.add_argument("--artifacts", type=int, default=100, help="Artifacts to construct per class")
+    parser.add_argument("--concurrency", type=int, default=16, help="Constructions in flight at once")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every stand-in response is delayed")
+    parser.add_argument("--payload-size", type=int, default=64 * 1024, help="Approximate bytes per generated page, image, clip or response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stand-in responses that are a retryable 503")
+    parser.add_argument("--only", nargs="*", help="Only run these benchmarks, by name")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    # Keep handler I/O out of the numbers, retried errors are counted by the stand-in server instead
+    logging.disable(logging.WARNING)
+    os.environ.setdefault("STABILITY_API_KEY", "benchmark")
+    os.environ.setdefault("ELEVEN_API_KEY", "benchmark")
+    os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("only", "output")},
+        "instantiation": {},
+        "construct": {}
+    }
+
+    for name, factory in INSTANTIATION.items():
+        if args.only and name not in args.only:
+            continue
+        result = report["instantiation"][name] = bench_instantiation(factory, args.n)
+        print(f"{name:<28} {result['instances_per_second']:>12,.0f} instances/s {result['bytes_per_instance']:>8,.0f} bytes/instance")
+
+    with StandInServer(args.latency, args.payload_size, args.error_rate) as server, tempfile.TemporaryDirectory() as output_dir:
+        for name, (factory, extension) in construct_benchmarks(server.url, args.payload_size).items():
+            if args.only and name not in args.only:
+                continue
+            result = report["construct"][name] = bench_construct(factory, extension, args.artifacts, args.concurrency, os.path.join(output_dir, name))
+            print(f"{name:<28} {format_value(result['artifacts_per_second'], width=8)} artifacts/s  p50 {format_value(result['latency_p50'], 1000)} ms  p99 {format_value(result['latency_p99'], 1000)} ms  "
+                  f"{format_value(result['bytes_per_artifact'], 1 / 1024, width=8)} KiB/artifact  {format_value(result['output_bytes_per_second'], 1 / 1024 / 1024)} MiB/s written  "
+                  f"{result['failed']} failed, {result['sample_failures']} memory samples failed")
+        report["stand_in"] = {"requests": server.requests, "errors": server.errors}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,44 @@
 # test_web_scraper_artifact.py
-from artifacts import WebScraperArtifact, MediaWebScraperArtifact, StabilityArtifact
+from artifacts import WebScraperArtifact, MediaWebScraperArtifact, CrawlerArtifact, iter_sentences, StabilityArtifact, MediaStabilityArtifact, NarrationArtifact, ClaudeArtifact
+from artifact import Artifact
+from artifact_cache import MemoryCache, DiskCache, TieredCache
+from artifact_executor import construct_many, aconstruct_many
+from artifact_graph import ArtifactGraph
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import artifact_http
+from artifact_logger import configure_logging, shutdown_logging
+import io
+import json
+import sys
+from artifact_store import ArtifactStore, Blob
+import artifact_ratelimit
+from artifact_ratelimit import TokenBucket
+from artifact_claude_batch import construct_claude_batch, StubBatchBackend
+from artifact_scrape import scrape_many
+from artifact_metrics import Aggregator, JsonLinesSink, PrometheusExporter, MultiSink
+from artifact_timeline import Timeline, IntervalIndex
+from artifacts import MediaNarrationArtifact
+from artifact_worker import WorkQueue, Worker, start_workers, construct_distributed
+from bench import StandInServer, bench_construct, construct_benchmarks
 import random
+import subprocess
+import asyncio
+import threading
+import time
+import os
+
+class EchoArtifact(Artifact):
+    # Offline artifact for exercising the base machinery without hitting any API
+    calls = 0
+
+    @classmethod
+    def build(cls, text: str, **kwargs):
+        return cls({"text": text}, **kwargs)
+
+    def generate_data(self, prompt: dict, payload_data):
+        EchoArtifact.calls += 1
+        return {"echo": prompt["text"]}, {"length": len(prompt["text"])}
+
 def test_web_scraper_artifact():
     url = 'https://www.reddit.com/'
     user_agent = 'Mozilla/5.0'
@@ -26,6 +64,666 @@ def test_stability_artifact():
         
     g.output_data_to_file("images/"+"testimage.png")
     
-    
+
+def test_instantiation_checks(monkeypatch):
+    try:
+        EchoArtifact({"text": "x"}, mandatory_tags={"bad": object()})
+        assert False, "expected a ValueError"
+    except ValueError as e:
+        assert "Mandatory tags" in str(e)
+    monkeypatch.setattr(EchoArtifact, "validate_json", False)
+    artifact = EchoArtifact({"text": "x"}, mandatory_tags={"bad": object()})
+    assert artifact.logger is EchoArtifact.logger and artifact.logger.name == "EchoArtifact"
+    assert not hasattr(ClaudeArtifact.build("a", "b"), "__dict__")
+
+def test_queued_json_logging():
+    stream = io.StringIO()
+    configure_logging(level="INFO", json_format=True, use_queue=True, stream=stream)
+    try:
+        EchoArtifact.logger.debug("hidden %s", "debug")
+        EchoArtifact.logger.info("Built %s artifacts", 3)
+        shutdown_logging()
+        EchoArtifact.logger.info("After shutdown")
+    finally:
+        configure_logging(level="DEBUG", json_format=False, use_queue=False, stream=sys.stderr)
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(entry["name"], entry["level"], entry["message"]) for entry in entries] == [
+        ("EchoArtifact", "INFO", "Built 3 artifacts"), ("EchoArtifact", "INFO", "After shutdown")]
+    for level in ("20", "verbose"):
+        result = subprocess.run([sys.executable, "-c", "import artifacts, artifact_logger; print(artifact_logger._settings.level)"],
+                                env=dict(os.environ, ARTIFACT_LOG_LEVEL=level), capture_output=True, text=True)
+        assert result.returncode == 0 and result.stdout.strip() == ("20" if level == "20" else "10")
+
+def test_artifact_cache(tmp_path):
+    EchoArtifact.calls = 0
+    EchoArtifact.cache = TieredCache(MemoryCache(max_entries=1), DiskCache(str(tmp_path)))
+    try:
+        for text in ["a", "a", "b", "a"]:
+            artifact = EchoArtifact.build(text)
+            artifact.construct()
+            assert artifact.data == {"echo": text}
+    finally:
+        EchoArtifact.cache, cache = None, EchoArtifact.cache
+
+    assert EchoArtifact.calls == 2
+    assert cache.hits == 2 and cache.misses == 2
+    assert cache.memory.evictions == 2
+    assert cache.disk.hits == 1
+
+    EchoArtifact.cache = MemoryCache()
+    try:
+        first, second = EchoArtifact.build("edited"), EchoArtifact.build("edited")
+        first.construct()
+        first.data["echo"] = "changed"
+        first.metadata["length"] = 0
+        second.construct()
+    finally:
+        EchoArtifact.cache = None
+    assert second.data == {"echo": "edited"} and second.metadata == {"length": 6}
+
+    disk = DiskCache(str(tmp_path / "bounded"), max_bytes=3000)
+    for i in range(5):
+        disk.set(f"key{i}", (b"x" * 1000, None))
+        time.sleep(0.01)
+    assert disk.evictions == 3 and disk.get("key0") is None and disk.get("key4") is not None
+    assert disk.size == sum(os.path.getsize(disk._path(key)) for key in ("key3", "key4"))
+    assert DiskCache(disk.directory).size == disk.size
+
+class SlowArtifact(EchoArtifact):
+    provider = "slow"
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def generate_data(self, prompt: dict, payload_data):
+        with SlowArtifact.lock:
+            SlowArtifact.active += 1
+            SlowArtifact.peak = max(SlowArtifact.peak, SlowArtifact.active)
+        time.sleep(0.05)
+        with SlowArtifact.lock:
+            SlowArtifact.active -= 1
+        if prompt["text"] == "fail":
+            raise RuntimeError("boom")
+        return super().generate_data(prompt, payload_data)
+
+# 400 silent MPEG-1 Layer III frames at 128kbps/44.1kHz, roughly ten seconds of audio
+MP3_FRAMES = (b'\xff\xfb\x90\x00' + b'\x00' * 413) * 400
+
+class LocalProvider:
+    # Serves a fixed body on every POST so provider artifacts can be pointed at localhost
+    def __init__(self, provider: str, body: bytes, content_type: str, failures: int = 0):
+        requests_seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                requests_seen.append(self.path)
+                if len(requests_seen) <= failures:
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', '2')
+                    self.end_headers()
+                    self.wfile.write(b'{}')
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.provider = provider
+        self.requests_seen = requests_seen
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.original_url = artifact_http.get_config(provider).base_url
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        artifact_http.configure(self.provider, base_url=f"http://127.0.0.1:{self.server.server_port}")
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        artifact_http.configure(self.provider, base_url=self.original_url)
+
+class LocalSite:
+    # Serves a dict of path -> HTML on GET, or a 301 for a ("redirect", location) value, anything else is a 404
+    def __init__(self, pages: dict):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = pages.get(self.path)
+                if isinstance(body, tuple):
+                    self.send_response(301)
+                    self.send_header('Location', body[1])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200 if body is not None else 404)
+                body = (body or 'Not Found').encode('utf-8')
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+
+def test_scrape_many():
+    pages = {f"/{i}": f"<html><head><title>Page {i}</title></head><body><p>First {i}</p><p>Second</p></body></html>" for i in range(20)}
+    with LocalSite(pages) as site:
+        artifacts = [WebScraperArtifact.build(f"{site.url}/{i}") for i in range(20)] + [WebScraperArtifact.build(f"{site.url}/missing", parser="lxml")]
+        results = scrape_many(artifacts, fetch_concurrency=4, parse_workers=2)
+    assert all(result.ok for result in results[:20]) and not results[20].ok
+    assert artifacts[7].data == {"title": "Page 7", "paragraphs": ["First 7", "Second"]}
+    assert artifacts[7].metadata["status_code"] == 200 and artifacts[7].constructed
+
+    with LocalSite(pages) as site:
+        artifact = WebScraperArtifact.build(f"{site.url}/3")
+        asyncio.run(artifact.aconstruct())
+    assert artifact.data == {"title": "Page 3", "paragraphs": ["First 3", "Second"]}
+
+def test_crawler():
+    pages = {
+        "/robots.txt": "User-agent: *\nDisallow: /private",
+        "/": '<title>Home</title><p>Welcome</p><a href="/a">A</a><a href="/a#top">A again</a><a href="/private">P</a><a href="/big">Big</a>',
+        "/a": '<title>A</title><p>Page A</p><a href="/">Home</a><a href="/b">B</a>',
+        "/b": '<title>B</title><a href="/c">C</a><a href="/docs">Docs</a><a href="/old-docs">Old docs</a>',
+        "/docs": ("redirect", "/docs/"),
+        "/old-docs": ("redirect", "/docs/"),
+        "/docs/": '<title>Docs</title><a href="intro">Intro</a>',
+        "/docs/intro": '<title>Intro</title>',
+        "/c": '<title>C</title>',
+        "/private": '<title>Private</title>',
+        "/big": '<title>Big</title>' + '<p>x</p>' * 1000
+    }
+    with LocalSite(pages) as site:
+        artifact = CrawlerArtifact.build(site.url + "/", max_depth=4, max_page_bytes=1024, per_host_concurrency=2)
+        pages = list(artifact.stream())
+    titles = [page["title"] for page in pages]
+    assert titles[0] == "Home" and sorted(titles) == ["A", "B", "C", "Docs", "Home", "Intro"]
+    assert {page["title"]: page["url"] for page in pages}["Docs"] == site.url + "/docs/" and not artifact.metadata["errors"]
+    assert artifact.constructed and artifact.data["pages"][0]["paragraphs"] == ["Welcome"]
+    assert artifact.metadata["skipped"] == {"robots": 1, "content_type": 0, "size": 1}
+
+def test_bench_construct(tmp_path, monkeypatch):
+    monkeypatch.setenv("STABILITY_API_KEY", "test")
+    with StandInServer(payload_size=4096, error_rate=0.3) as server:
+        benchmarks = construct_benchmarks(server.url, 4096)
+        for name in ("StabilityArtifact", "ClaudeArtifact"):
+            factory, extension = benchmarks[name]
+            result = bench_construct(factory, extension, 10, 4, str(tmp_path / name), memory_samples=2)
+            assert result["failed"] == 0 and result["latency_p50"] <= result["latency_p99"]
+            assert result["output_bytes_per_second"] > 0
+    assert server.errors > 0
+    # Keep-alive responses must not wait out a ~40 ms delayed ACK, or that floor hides every real change
+    with StandInServer(payload_size=4096) as server:
+        factory, extension = construct_benchmarks(server.url, 4096)["StabilityArtifact"]
+        result = bench_construct(factory, extension, 10, 1, str(tmp_path / "latency"), memory_samples=1)
+    assert result["latency_p50"] < 0.02
+    with StandInServer(payload_size=4096, error_rate=1.0) as server:
+        factory, extension = construct_benchmarks(server.url, 4096)["StabilityArtifact"]
+        result = bench_construct(factory, extension, 2, 2, str(tmp_path / "failing"), memory_samples=2)
+    assert result["failed"] == 2 and result["sample_failures"] == 2 and result["latency_p50"] is None
+
+def test_metrics(tmp_path, monkeypatch):
+    aggregator, exporter = Aggregator(), PrometheusExporter()
+    monkeypatch.setattr(Artifact, "metrics", MultiSink(aggregator, exporter, JsonLinesSink(str(tmp_path / "metrics.jsonl"))))
+    with LocalProvider("elevenlabs", MP3_FRAMES, "audio/mpeg", failures=1):
+        artifact = NarrationArtifact.build("Measure me")
+        artifact.construct()
+    artifact.output_data_to_file(str(tmp_path / "out" / "narration.mp3"))
+
+    metrics = artifact.metadata["metrics"]
+    assert metrics["retries"] == 1 and metrics["bytes_in"] == len(MP3_FRAMES)
+    assert 0 < metrics["network_time"] <= metrics["generate_time"] <= metrics["wall_time"] and "validate_time" in metrics
+    rows = {row["phase"]: row for row in aggregator.summary()}
+    assert set(rows) == {"construct", "generate", "validate", "output"} and all(row["count"] == 1 for row in rows.values())
+    assert rows["output"]["bytes_out"] > len(MP3_FRAMES)
+    assert 'artifact_retries_total{artifact="NarrationArtifact",provider="elevenlabs",phase="construct"} 1' in exporter.render()
+    assert len((tmp_path / "metrics.jsonl").read_text().splitlines()) == 4
+
+def test_metrics_streams_and_batches(monkeypatch):
+    aggregator = Aggregator()
+    monkeypatch.setattr(Artifact, "metrics", aggregator)
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    with LocalProvider("elevenlabs", MP3_FRAMES, "audio/mpeg"):
+        narration = NarrationArtifact.build("Stream and measure me")
+        list(narration.stream())
+    with LocalProvider("anthropic", claude_stream_body(["Measured", " stream."]), "text/event-stream"):
+        claude = ClaudeArtifact.build("Say", "measured", max_response_length=100)
+        list(claude.stream())
+    with LocalSite({"/": "<title>Home</title><p>Hi</p>"}) as site:
+        scraped = WebScraperArtifact.build(site.url + "/")
+        crawled = CrawlerArtifact.build(site.url + "/", respect_robots=False)
+        scrape_many([scraped], parse_workers=1)
+        list(crawled.stream())
+    batched = ClaudeArtifact.build("Summarise", "batched")
+    construct_claude_batch([batched], backend=StubBatchBackend(), poll_interval=0)
+
+    assert narration.metadata["metrics"]["bytes_in"] == len(MP3_FRAMES)
+    assert claude.metadata["metrics"]["network_time"] > 0 and scraped.metadata["metrics"]["bytes_in"] > 0
+    assert crawled.metadata["metrics"]["bytes_in"] > 0 and batched.metadata["metrics"]["bytes_in"] == len("Summarise batched")
+    counts = {(row["artifact"], row["phase"]): row["count"] for row in aggregator.summary()}
+    for name in ("NarrationArtifact", "ClaudeArtifact", "WebScraperArtifact", "CrawlerArtifact"):
+        assert counts[(name, "construct")] >= 1 and counts[(name, "generate")] >= 1 and counts[(name, "validate")] >= 1
+    assert counts[("ClaudeArtifact", "construct")] == 2
+
+def test_distributed_workers(tmp_path):
+    queue, store = WorkQueue(str(tmp_path / "queue.db"), max_attempts=2), ArtifactStore(str(tmp_path / "store"))
+    workers = start_workers(queue.path, store.root, processes=2, modules=("test",), idle_timeout=1, poll_interval=0.05)
+    artifacts = [EchoArtifact.build(f"job {i}") for i in range(20)] + [EchoArtifact.build("job 3"), SlowArtifact.build("fail")]
+    results = construct_distributed(artifacts, queue, store, timeout=30, poll_interval=0.05)
+    for process in workers:
+        process.join()
+    assert [result.ok for result in results] == [True] * 21 + [False]
+    assert results[20].artifact.data == {"echo": "job 3"} and results[20].artifact.constructed
+    assert "failed after 2 attempts" in str(results[21].error)
+    assert queue.counts() == {"pending": 0, "running": 0, "done": 20, "failed": 1}
+
+def test_worker_lease_expiry(tmp_path):
+    queue, store = WorkQueue(str(tmp_path / "queue.db")), ArtifactStore(str(tmp_path / "store"))
+    job_id = queue.submit(EchoArtifact.build("orphaned"))
+    assert queue.claim("crashed-worker", lease_seconds=0)["id"] == job_id
+    time.sleep(0.01)
+    worker = Worker(queue, store, worker_id="healthy-worker", poll_interval=0.01)
+    worker.run(max_jobs=1)
+    assert queue.job(job_id)["status"] == "done" and queue.job(job_id)["attempts"] == 2
+    assert store.load(job_id).data == {"echo": "orphaned"}
+
+    job_id = queue.submit(EchoArtifact.build("reclaimed"))
+    queue.claim("slow-worker", lease_seconds=0)
+    time.sleep(0.01)
+    queue.claim("new-owner")
+    assert not queue.complete(job_id, "slow-worker") and queue.job(job_id)["status"] == "running"
+    assert queue.complete(job_id, "new-owner") and queue.job(job_id)["status"] == "done"
+
+def claude_stream_body(deltas):
+    # Server-sent events in the order the Messages API streams them
+    events = [("message_start", {"type": "message_start", "message": {"id": "msg_test", "type": "message", "role": "assistant", "model": "claude-3-sonnet-20240229", "content": [], "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 5, "output_tokens": 0}}}),
+              ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})]
+    events += [("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": delta}}) for delta in deltas]
+    events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+               ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": 12}}),
+               ("message_stop", {"type": "message_stop"})]
+    return "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events).encode("utf-8")
+
+def test_claude_streaming(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    deltas = ["Hello there", ". How are", " you? Fine", ".\n\nBye"]
+    with LocalProvider("anthropic", claude_stream_body(deltas), "text/event-stream", failures=1) as provider:
+        artifact = ClaudeArtifact.build("Say", "hello", max_response_length=100)
+        assert list(artifact.stream_sentences()) == ["Hello there.", "How are you?", "Fine.", "Bye"]
+        assert artifact.constructed and artifact.data["response"] == "".join(deltas)
+        assert artifact.metadata["actual_response_length"] == len("".join(deltas)) and len(provider.requests_seen) == 2
+
+        async def collect():
+            streamed = ClaudeArtifact.build("Say", "hello again", max_response_length=100)
+            return [delta async for delta in streamed.astream()], streamed
+        streamed_deltas, streamed = asyncio.run(collect())
+    assert streamed_deltas == deltas and streamed.data["response"] == "".join(deltas)
+    assert list(iter_sentences(["No boundary yet", " e.g. 3.14 is pi."])) == ["No boundary yet e.g.", "3.14 is pi."]
+
+def test_timeline():
+    narration = [MediaNarrationArtifact({"prompt": f"line {i}"}, start_time=i * 10, end_time=i * 10 + 10) for i in range(100) if i != 50]
+    images = [MediaStabilityArtifact({"prompt": f"shot {i}", "resolution": "64,64"}, mandatory_tags={"position_x": 0, "position_y": 0}, start_time=i * 25, end_time=i * 25 + 30) for i in range(40)]
+    timeline = Timeline(narration + images, track=lambda artifact: artifact.__class__.__name__)
+
+    assert len(timeline) == 139 and (timeline.start_time, timeline.end_time) == (0, 1005)
+    assert [artifact.prompt["prompt"] for artifact in timeline.at(55)] == ["line 5", "shot 2"]
+    assert [artifact.start_time for artifact in timeline.window(495, 510, track="MediaNarrationArtifact")] == [490]
+    assert timeline.gaps(track="MediaNarrationArtifact") == [(500, 510), (1000, 1005)]
+    overlaps = list(timeline.overlaps())
+    assert len(overlaps) == 39 and all(first.__class__ is second.__class__ is MediaStabilityArtifact for first, second, _, _ in overlaps)
+    assert (overlaps[0][2], overlaps[0][3]) == (25, 30)
+
+    manifest = timeline.manifest(start=100, end=130)
+    first = next(manifest)
+    assert first["start_time"] == 75 and first["track"] == "MediaStabilityArtifact" and first["position"] == (0, 0) and first["resolution"] == (64, 64)
+    assert [entry["start_time"] for entry in manifest] == [100, 100, 110, 120, 125]
+
+    rng = random.Random(0)
+    intervals = [(start, start + rng.randint(0, 50), i) for i, start in enumerate(rng.randint(0, 1000) for _ in range(500))]
+    bulk, incremental = IntervalIndex(), IntervalIndex()
+    bulk.extend(intervals[:400])
+    bulk.add(*intervals[400])
+    bulk.extend(intervals[401:])
+    for interval in intervals:
+        incremental.add(*interval)
+    for point in range(0, 1060, 7):
+        assert bulk.stab(point) == incremental.stab(point) == sorted((iv for iv in intervals if iv[0] <= point < iv[1]), key=lambda iv: (iv[0], iv[2]))
+
+def test_narration_streaming(tmp_path):
+    with LocalProvider("elevenlabs", MP3_FRAMES, "audio/mpeg"):
+        artifact = NarrationArtifact.build("Hello there")
+        chunks = list(artifact.stream(chunk_size=4096))
+        assert artifact.constructed and b''.join(chunks) == MP3_FRAMES
+        assert 10 < artifact.metadata["duration"] < 11
+
+        spool_path = os.path.join(tmp_path, "narration.mp3")
+        spooled = NarrationArtifact.build("Hello there", spool_path=spool_path)
+        spooled.construct()
+        spooled.output_data_to_file(spool_path)
+        with open(spool_path, 'rb') as f:
+            assert f.read() == MP3_FRAMES
+
+        async_artifact = NarrationArtifact.build("Hello there")
+        asyncio.run(async_artifact.aconstruct())
+        assert async_artifact.data["audio"] == MP3_FRAMES
+
+def test_narration_spool_cache_hit(tmp_path, monkeypatch):
+    cache = MemoryCache()
+    monkeypatch.setattr(NarrationArtifact, "cache", cache)
+    first_path, second_path = str(tmp_path / "first.mp3"), str(tmp_path / "second.mp3")
+    with LocalProvider("elevenlabs", MP3_FRAMES, "audio/mpeg") as provider:
+        first = NarrationArtifact.build("Cached line", spool_path=first_path)
+        first.construct()
+        second = NarrationArtifact.build("Cached line", spool_path=second_path)
+        second.construct()
+    assert len(provider.requests_seen) == 1 and cache.hits == 1
+    assert isinstance(first.data["audio"], Blob) and second.data["audio"] == MP3_FRAMES
+    os.remove(first_path)
+    second.output_data_to_file(second_path)
+    with open(second_path, 'rb') as f:
+        assert f.read() == MP3_FRAMES
+
+def test_narration_spool_single_flight(tmp_path):
+    # A coalesced waiter must not be handed the leader's spool file
+    first_path, second_path = str(tmp_path / "first.mp3"), str(tmp_path / "second.mp3")
+    with LocalProvider("elevenlabs", MP3_FRAMES, "audio/mpeg") as provider:
+        first = NarrationArtifact.build("Coalesced line", spool_path=first_path)
+        second = NarrationArtifact.build("Coalesced line", spool_path=second_path)
+        asyncio.run(aconstruct_many([first, second]))
+    assert len(provider.requests_seen) == 1
+    leader, waiter = (first, second) if isinstance(first.data["audio"], Blob) else (second, first)
+    assert waiter.data["audio"] == MP3_FRAMES
+    os.remove(leader.spool_path)
+    waiter.output_data_to_file(waiter.spool_path)
+    with open(waiter.spool_path, 'rb') as f:
+        assert f.read() == MP3_FRAMES
+
+def test_artifact_store(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    image = b'\x89PNG' + os.urandom(1024)
+    original = MediaStabilityArtifact(
+        {"prompt": "A man in a tree", "resolution": "64,64"},
+        mandatory_tags={"position_x": 0, "position_y": 0},
+        start_time=0, end_time=5,
+        data={"image": image}, metadata={"prompt": "A man in a tree"}, constructed=True
+    )
+    artifact_id = store.save(original)
+    store.save(original, "copy")
+    assert len(os.listdir(os.path.join(tmp_path, "blobs"))) == 1
+
+    loaded = store.load(artifact_id)
+    assert loaded.constructed and isinstance(loaded, MediaStabilityArtifact)
+    assert isinstance(loaded.data["image"], Blob) and loaded.data["image"].read() == image
+    assert loaded.start_time == 0 and loaded.end_time == 5
+    assert loaded.cache_key() == original.cache_key()
+
+    eager = store.load("copy", lazy=False)
+    assert eager.data["image"] == image
+
+def test_lazy_blobs(tmp_path):
+    store = ArtifactStore(str(tmp_path / "store"))
+    with LocalProvider("elevenlabs", MP3_FRAMES, "audio/mpeg"):
+        NarrationArtifact.blob_store = store
+        try:
+            offloaded = NarrationArtifact.build("Hello there")
+            offloaded.construct()
+        finally:
+            NarrationArtifact.blob_store = None
+        assert isinstance(offloaded.data["audio"], Blob)
+        assert len(repr(offloaded)) < 1000
+        with offloaded.data["audio"].mapped() as view:
+            assert view[:4] == MP3_FRAMES[:4]
+
+        spooled = NarrationArtifact.build("Hello there", spool_path=str(tmp_path / "spool.mp3"))
+        spooled.construct()
+        assert isinstance(spooled.data["audio"], Blob)
+
+    output_path = str(tmp_path / "out" / "narration.mp3")
+    spooled.output_data_to_file(output_path)
+    with open(output_path, 'rb') as f:
+        assert f.read() == MP3_FRAMES
+    assert store.load(store.save(offloaded)).data["audio"].path == offloaded.data["audio"].path
+
+def test_pooled_sessions(monkeypatch):
+    monkeypatch.setenv("STABILITY_API_KEY", "test")
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps the connection open between requests so reuse shows up as one client port
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            connections.append(self.client_address)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            self.wfile.write(b'\x89PNG')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    original_url = artifact_http.get_config("stability").base_url
+    artifact_http.configure("stability", base_url=f"http://127.0.0.1:{server.server_port}")
+    try:
+        session = artifact_http.get_session("stability")
+        for prompt in ("A pooled tree", "A pooled lake"):
+            StabilityArtifact.build(prompt, 0, 0, 64, 64).construct()
+        assert artifact_http.get_session("stability") is session and isinstance(session, artifact_http.PooledSession)
+        assert len(connections) == 2 and connections[0] == connections[1]
+
+        artifact_http.configure("stability", timeout=5.0)
+        replaced = artifact_http.get_session("stability")
+        assert replaced is not session and replaced.timeout == 5.0
+        StabilityArtifact.build("A fresh tree", 0, 0, 64, 64).construct()
+        assert len(connections) == 3 and connections[2] != connections[0]
+    finally:
+        server.shutdown()
+        artifact_http.configure("stability", timeout=120.0, base_url=original_url)
+
+def test_async_client_lifecycle(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+
+    async def main():
+        client = artifact_http.get_async_client("web")
+        claude = artifact_http.get_async_anthropic_client()
+        artifact_http.configure("web", timeout=5.0)
+        await asyncio.sleep(0.01)
+        assert client.is_closed and not claude.is_closed()
+        replaced = artifact_http.get_async_client("web")
+        assert replaced is not client and replaced.timeout.read == 5.0
+        await artifact_http.aclose_all()
+        assert replaced.is_closed and claude.is_closed()
+        last = artifact_http.get_async_client("web")
+        assert last is not replaced
+        artifact_http.close_all()
+        await asyncio.sleep(0.01)
+        assert last.is_closed
+
+    try:
+        asyncio.run(main())
+    finally:
+        artifact_http.configure("web", timeout=30.0)
+
+def test_retry_after_rate_limit(monkeypatch):
+    monkeypatch.setenv("STABILITY_API_KEY", "test")
+    with LocalProvider("stability", b'\x89PNG', "image/png", failures=2) as provider:
+        artifact = StabilityArtifact.build("A man in a tree", 0, 0, 64, 64)
+        artifact.construct()
+    assert artifact.data["image"] == b'\x89PNG'
+    assert len(provider.requests_seen) == 3
+
+    bucket = TokenBucket(60, capacity=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0
+    assert 0.9 < bucket.reserve() <= 1.0
+
+def test_token_usage_settlement(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    message = {"id": "msg_test", "type": "message", "role": "assistant", "model": "claude-3-sonnet-20240229", "content": [{"type": "text", "text": "Short."}],
+               "stop_reason": "end_turn", "stop_sequence": None, "usage": {"input_tokens": 9, "output_tokens": 3}}
+    artifact_ratelimit.configure("anthropic", input_tokens_per_minute=20000, output_tokens_per_minute=8000)
+    settled = []
+    limiter = artifact_ratelimit.get_limiter("anthropic")
+    settle = limiter.settle
+    monkeypatch.setattr(limiter, "settle", lambda reserved, used: settled.append((reserved, used)) or settle(reserved, used))
+    try:
+        with LocalProvider("anthropic", json.dumps(message).encode("utf-8"), "application/json", failures=1):
+            ClaudeArtifact.build("Be", "brief", max_response_length=4096).construct()
+        with LocalProvider("anthropic", claude_stream_body(["Streamed."]), "text/event-stream"):
+            list(ClaudeArtifact.build("Be", "brief again", max_response_length=4096).stream())
+    finally:
+        artifact_ratelimit.configure("anthropic")
+    # The 429 is refunded in full, the rest are corrected to the usage the responses reported
+    assert settled == [((2, 4096), (0, 0)), ((2, 4096), (9, 3)), ((3, 4096), (5, 12))]
+
+    bucket = TokenBucket(60, capacity=100)
+    bucket.reserve(90)
+    bucket.settle(90, 5)
+    assert 95 <= bucket.tokens < 96
+    bucket.settle(0, 200)
+    assert -6 <= bucket.tokens < -4
+
+def test_single_flight():
+    EchoArtifact.calls = 0
+    artifacts = [SlowArtifact.build("same") for _ in range(5)] + [SlowArtifact.build("other")]
+    results = construct_many(artifacts, provider_limits={"slow": 6})
+
+    assert all(result.ok for result in results)
+    assert EchoArtifact.calls == 2
+    assert artifacts[0].data == artifacts[4].data and artifacts[0].data is not artifacts[4].data
+
+    EchoArtifact.calls = 0
+    asyncio.run(aconstruct_many([SlowArtifact.build("async") for _ in range(5)]))
+    assert EchoArtifact.calls == 1
+
+def test_claude_batch():
+    def responder(params):
+        if "fail" in params["messages"][0]["content"]:
+            raise ValueError("bad request")
+        return params["messages"][0]["content"].upper()
+
+    backend = StubBatchBackend(responder, polls_until_done=2)
+    artifacts = [ClaudeArtifact.build("Summarise", text) for text in ["trees", "bees", "trees", "fail"]]
+    results = construct_claude_batch(artifacts, backend=backend, poll_interval=0)
+
+    assert [result.ok for result in results] == [True, True, True, False]
+    assert artifacts[0].data == {"response": "SUMMARISE TREES"}
+    assert artifacts[0].metadata["batch_id"] == "msgbatch_stub_0"
+    assert len(backend.batches["msgbatch_stub_0"]["requests"]) == 3
+
+    class StuckSecondBatch(StubBatchBackend):
+        def is_done(self, batch_id: str) -> bool:
+            return batch_id != "msgbatch_stub_1" and super().is_done(batch_id)
+
+    artifacts = [ClaudeArtifact.build("Summarise", text) for text in ["ants", "bats", "cats", "dogs", "eels"]]
+    results = construct_claude_batch(artifacts, backend=StuckSecondBatch(), poll_interval=0, timeout=0.01, max_batch_size=2)
+    assert [result.ok for result in results] == [True, True, False, False, True]
+    assert isinstance(results[2].error, TimeoutError) and artifacts[4].data == {"response": "Summarise eels"}
+
+    class FailingLaterSubmits(StubBatchBackend):
+        def submit(self, requests: list) -> str:
+            if self.batches:
+                raise ConnectionError("submit failed")
+            return super().submit(requests)
+
+    class FailingResults(StubBatchBackend):
+        def is_done(self, batch_id: str) -> bool:
+            # Every chunk is in flight before the first one is polled
+            assert len(self.batches) == 3
+            return super().is_done(batch_id)
+
+        def results(self, batch_id: str):
+            if batch_id == "msgbatch_stub_2":
+                raise ConnectionError("results failed")
+            return super().results(batch_id)
+
+    artifacts = [ClaudeArtifact.build("Summarise", text) for text in ["ants", "bats", "cats", "dogs", "eels"]]
+    results = construct_claude_batch(artifacts, backend=FailingLaterSubmits(), poll_interval=0, max_batch_size=2)
+    assert [result.ok for result in results] == [True, True, False, False, False]
+    assert isinstance(results[2].error, ConnectionError)
+
+    artifacts = [ClaudeArtifact.build("Summarise", text) for text in ["ants", "bats", "cats", "dogs", "eels"]]
+    backend = FailingResults(polls_until_done=3)
+    results = construct_claude_batch(artifacts, backend=backend, poll_interval=0, max_batch_size=2)
+    assert [result.ok for result in results] == [True, True, True, True, False]
+    assert isinstance(results[4].error, ConnectionError)
+
+def test_construct_many():
+    SlowArtifact.peak = 0
+    artifacts = [SlowArtifact.build(str(i)) for i in range(8)] + [SlowArtifact.build("fail")]
+    results = construct_many(artifacts, max_concurrency=8, provider_limits={"slow": 3})
+
+    assert [result.artifact for result in results] == artifacts
+    assert all(result.ok for result in results[:-1])
+    assert isinstance(results[-1].error, RuntimeError)
+    assert SlowArtifact.peak == 3
+
+def test_artifact_graph():
+    graph = ArtifactGraph()
+    script = graph.add("script", SlowArtifact.build("script"))
+    left = graph.derive("left", lambda a: SlowArtifact.build(a.data["echo"] + "-left"), script)
+    right = graph.derive("right", lambda a: SlowArtifact.build(a.data["echo"] + "-right"), script)
+    graph.derive("joined", lambda l, r: SlowArtifact.build(l.data["echo"] + r.data["echo"]), left, right)
+    broken = graph.derive("broken", lambda a: SlowArtifact.build("fail"), script)
+    graph.derive("after_broken", lambda a: SlowArtifact.build("never"), broken)
+
+    run = graph.run(max_concurrency=4)
+
+    assert run.artifacts["joined"].data["echo"] == "script-leftscript-right"
+    assert list(run.errors) == ["broken"]
+    assert run.skipped == ["after_broken"]
+    assert run.critical_path[0] == "script" and run.critical_path[-1] == "joined"
+    assert run.wall_time < sum(end - start for start, end in run.timings.values())
+
+def test_artifact_graph_incremental(tmp_path):
+    def build_graph(left_suffix):
+        graph = ArtifactGraph()
+        script = graph.add("script", EchoArtifact.build("script"))
+        left = graph.derive("left", lambda a: EchoArtifact.build(a.data["echo"] + left_suffix), script)
+        right = graph.derive("right", lambda a: EchoArtifact.build(a.data["echo"] + "-right"), script)
+        graph.derive("joined", lambda l, r: EchoArtifact.build(l.data["echo"] + r.data["echo"]), left, right)
+        return graph
+
+    EchoArtifact.calls = 0
+    build_graph("-left").run(state_dir=str(tmp_path))
+    assert EchoArtifact.calls == 4
+
+    run = build_graph("-left").run(state_dir=str(tmp_path))
+    assert EchoArtifact.calls == 4
+    assert sorted(run.reused) == ["joined", "left", "right", "script"]
+
+    run = build_graph("-changed").run(state_dir=str(tmp_path))
+    assert EchoArtifact.calls == 6
+    assert sorted(run.reused) == ["right", "script"]
+    assert run.artifacts["joined"].data["echo"] == "script-changedscript-right"
+
+def test_aconstruct_many():
+    SlowArtifact.peak = 0
+    artifacts = [SlowArtifact.build(str(i)) for i in range(6)] + [SlowArtifact.build("fail")]
+    results = asyncio.run(aconstruct_many(artifacts, provider_limits={"slow": 2}))
+
+    assert all(result.ok for result in results[:-1])
+    assert results[0].artifact.data == {"echo": "0"}
+    assert isinstance(results[-1].error, RuntimeError)
+    assert SlowArtifact.peak == 2
+
 if __name__ == '__main__':
     test_web_scraper_artifact()
\ No newline at end of file